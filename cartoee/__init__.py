@@ -1 +1,81 @@
-from .plotting import *
+import sys
+import importlib
+
+# public names and the submodule defining them. Submodules are imported on
+# first use so `import cartoee` does not load ee, pyplot and cartopy
+_exports = {
+    'getMap':'plotting',
+    'getMapGrid':'plotting',
+    'addLayer':'plotting',
+    'addLayers':'plotting',
+    'refineLayers':'plotting',
+    'addColorbar':'plotting',
+    'renderMap':'plotting',
+    'fetchLayer':'plotting',
+    'Layer':'layer',
+    'ColorbarTemplate':'plotting',
+    'buildPalette':'palette',
+    'ThumbCache':'cache',
+    'enableCache':'cache',
+    'disableCache':'cache',
+    'setCache':'cache',
+    'getCache':'cache',
+    'setMemoryBudget':'cache',
+    'renderBatch':'batch',
+    'addFeatures':'features',
+    'animateCollection':'animate',
+    'PipelineStats':'instrument',
+    'addHook':'instrument',
+    'removeHook':'instrument',
+    'collectStats':'instrument',
+    'logEvents':'instrument',
+    'ThumbSession':'network',
+    'configureSession':'network',
+    'getSession':'network',
+    'setSession':'network',
+}
+
+if sys.version_info >= (3,5):
+    _exports.update({
+        'AsyncThumbClient':'aio',
+        'addLayerAsync':'aio',
+        'getMapAsync':'aio',
+    })
+
+_submodules = ['plotting','palette','layer','cache','batch','animate','features','instrument','network',
+               'warp','maptiles']
+
+if sys.version_info >= (3,5):
+    # aio uses async def, it is not installed under python 2
+    _submodules.append('aio')
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module('.'+_exports[name],__name__)
+        value = getattr(module,name)
+        globals()[name] = value
+        return value
+
+    if name in _submodules:
+        return importlib.import_module('.'+name,__name__)
+
+    # other names `from .plotting import *` used to expose, e.g. cartoee.ee
+    if not name.startswith('_'):
+        plotting = importlib.import_module('.plotting',__name__)
+        if hasattr(plotting,name):
+            return getattr(plotting,name)
+
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__,name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
+
+
+if sys.version_info < (3,7):
+    # module level __getattr__ is not supported, import everything up front
+    for _name in __all__:
+        globals()[_name] = __getattr__(_name)
@@ -0,0 +1,234 @@
+import time
+import asyncio
+import functools
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import cartopy.crs as ccrs
+import matplotlib.pyplot as plt
+
+from .cache import _resolveCache
+from .network import getSession
+from . import instrument
+from .plotting import (_checkAxes, _layerRequest, _tileGrid, _stitchTiles,
+                       _decodeThumb, _styleArray, _drawLayer, _mintUrl,
+                       _serverProjection)
+
+__all__ = ['AsyncThumbClient','addLayerAsync','getMapAsync']
+
+# get_event_loop() inside a coroutine is deprecated, get_running_loop() is python 3.7+
+_runningLoop = getattr(asyncio,'get_running_loop',asyncio.get_event_loop)
+
+
+def _retryDelay(session,retry,retryAfter=None):
+    """
+    Seconds to wait before retry number `retry`, with the backoff of the
+    ThumbSession and honouring a Retry-After header in seconds
+    """
+
+    try:
+        return max(float(retryAfter),0)
+    except (TypeError,ValueError):
+        return session.backoff * 2 ** (retry - 1)
+
+
+class AsyncThumbClient(object):
+    """
+    Client to mint thumbnail URLs and download them as awaitables
+
+    URL minting and ee.getInfo() calls run in the event loop's default
+    executor. Downloads use a pooled aiohttp session when aiohttp is
+    installed, with the timeouts and retry policy of the shared
+    ThumbSession, and fall back to the ThumbSession in the executor
+    otherwise. At most `limit` requests are in flight at once. Share one client between
+    layers and figures to overlap all of their I/O, ideally as an async
+    context manager so the session is closed when done.
+
+    Args:
+        limit (int, optional): maximum number of concurrent requests. Default is 8
+        cache (cartoee.cache.ThumbCache | bool, optional): on-disk cache for thumbnails. By default uses the cache set with enableCache() if any, True also enables one if none is set and False disables caching
+    """
+
+    def __init__(self,limit=8,cache=None):
+        self.limit = limit
+        self.cache = cache
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,*exc):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the underlying HTTP session
+        """
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def run(self,func,*args,**kwargs):
+        """
+        Run a blocking function in the event loop's default executor
+        """
+
+        loop = _runningLoop()
+
+        return await loop.run_in_executor(None,functools.partial(func,*args,**kwargs))
+
+    async def _download(self,url):
+        session = getSession()
+        if aiohttp is None:
+            return await self.run(session.get,url)
+
+        if self._session is None:
+            connectTimeout,readTimeout = session.timeout
+            timeout = aiohttp.ClientTimeout(sock_connect=connectTimeout,sock_read=readTimeout)
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self._session = aiohttp.ClientSession(connector=connector,timeout=timeout)
+
+        # same policy as ThumbSession, failed connections and the retry
+        # statuses are retried with exponential backoff
+        retry = 0
+        while True:
+            retryAfter = None
+            try:
+                async with self._session.get(url) as resp:
+                    if resp.status not in session.retryStatuses or retry >= session.retries:
+                        resp.raise_for_status()
+                        return await resp.read()
+                    retryAfter = resp.headers.get('Retry-After')
+            except (aiohttp.ClientConnectionError,asyncio.TimeoutError):
+                if retry >= session.retries:
+                    raise
+
+            retry += 1
+            await asyncio.sleep(_retryDelay(session,retry,retryAfter))
+
+    async def fetch(self,imgObj,args,cache=None):
+        """
+        Get the thumbnail bytes for a request, from the cache when possible
+
+        Args:
+            imgObj (ee.image.Image): Earth Engine image to request
+            args (dict): thumbnail request arguments passed to getThumbUrl()
+            cache (cartoee.cache.ThumbCache | bool, optional): overrides the client cache for this request
+
+        Returns:
+            data (bytes): encoded thumbnail
+        """
+
+        if cache is None:
+            cache = self.cache
+        cache = _resolveCache(cache)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+
+        async with self._semaphore:
+            if cache:
+                key = cache.key(imgObj,args)
+                data = await self.run(cache.get,key)
+                if data is not None:
+                    instrument.count('cache.hit')
+                    return data
+                instrument.count('cache.miss')
+
+            t0 = time.time()
+            url = await self.run(_mintUrl,imgObj,args)
+            t1 = time.time()
+            data = await self._download(url)
+            instrument.emit('mint',seconds=t1-t0)
+            instrument.emit('transfer',seconds=time.time()-t1,bytes=len(data))
+
+            if cache:
+                await self.run(cache.put,key,data)
+
+        return data
+
+
+async def addLayerAsync(imgObj,ax,dims=None,region=None,cmap=None,visParams=None,
+                        cache=None,tiles=None,fetchMode='png',reproject=True,
+                        client=None):
+    """
+    Add an Earth Engine image to a cartopy plot without blocking the event loop.
+
+    Same as addLayer() but the extent lookup, URL minting and download are
+    awaited so several layers or figures can fetch at the same time.
+
+    Args:
+        imgObj (ee.image.Image): Earth Engine image result to plot.
+        ax (cartopy.mpl.geoaxes.GeoAxesSubplot | cartopy.mpl.geoaxes.GeoAxes): required cartopy GeoAxesSubplot object to add image overlay to
+        dims (list | tuple | int | str, optional): dimensions to request earth engine result as [WIDTH,HEIGHT], see addLayer(). Default None and infers dimesions
+        region (list | tuple, optional): geospatial region of the image to render in format [W,S,E,N]. By default, the whole image
+        cmap (str, optional): string specifying matplotlib colormap to colorize image. If cmap is specified visParams cannot contain 'palette' key
+        visParams (dict, optional): visualization parameters as a dictionary. See https://developers.google.com/earth-engine/image_visualization for options
+        cache (cartoee.cache.ThumbCache | bool, optional): on-disk cache for the thumbnail. By default uses the client cache
+        tiles (int | list | tuple, optional): fetch the image as a grid of tiles, see addLayer(). Tiles are fetched concurrently up to the client limit
+        fetchMode (str, optional): 'png' or 'array', see addLayer(). Default is 'png'
+        reproject (bool, optional): reproject the image into the axes' projection once, see addLayer(). Default is True
+        client (cartoee.aio.AsyncThumbClient, optional): client to fetch with. Default creates a client for this call only
+
+    Returns:
+        ax (cartopy.mpl.geoaxes.GeoAxesSubplot): cartopy GeoAxesSubplot object with Earth Engine results displayed
+    """
+
+    _checkAxes(ax)
+
+    if client is None:
+        async with AsyncThumbClient(cache=cache) as client:
+            return await addLayerAsync(imgObj,ax,dims=dims,region=region,cmap=cmap,
+                                       visParams=visParams,cache=cache,tiles=tiles,
+                                       fetchMode=fetchMode,reproject=reproject,
+                                       client=client)
+
+    args,viewExtent,dims = await client.run(_layerRequest,ax,imgObj,dims,region,cmap,
+                                            visParams,fetchMode)
+    serverProj = _serverProjection(ax,args,viewExtent,reproject and not tiles)
+
+    if tiles:
+        shape,jobs = _tileGrid(args,viewExtent,dims,tiles)
+
+        async def fetch(job):
+            row,col,tileArgs = job
+            data = await client.fetch(imgObj,tileArgs,cache)
+            return row,col,await client.run(_decodeThumb,data)
+
+        a = _stitchTiles(shape,await asyncio.gather(*[fetch(job) for job in jobs]))
+
+    else:
+        data = await client.fetch(imgObj,args,cache)
+        a = await client.run(_decodeThumb,data)
+
+    style = {}
+    if fetchMode == 'array':
+        a,style = _styleArray(a,cmap,visParams)
+
+    _drawLayer(ax,a,viewExtent,reproject,serverProj,**style)
+
+    return ax
+
+
+async def getMapAsync(imgObj,proj=ccrs.PlateCarree(),**kwargs):
+    """
+    Awaitable version of getMap(), see addLayerAsync()
+
+    Args:
+        imgObj (ee.image.Image): Earth Engine image result to plot
+        proj (cartopy.crs, optional): Cartopy projection that determines the projection of the resulting plot. By default uses an equirectangular projection, PlateCarree
+        **kwargs: remaining keyword arguments are passed to addLayerAsync()
+
+    Returns:
+        ax (cartopy.mpl.geoaxes.GeoAxesSubplot): cartopy GeoAxesSubplot object with Earth Engine results displayed
+    """
+
+    ax = plt.axes(projection=proj)
+    ax = await addLayerAsync(imgObj,ax=ax,**kwargs)
+
+    return ax
@@ -0,0 +1,183 @@
+from __future__ import print_function, division
+import os
+import time
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+import ee
+import matplotlib.pyplot as plt
+from matplotlib import animation
+import cartopy.crs as ccrs
+
+from . import warp
+from . import instrument
+from .plotting import (_checkAxes, _layerRequest, _resolveDims, _serverProjection,
+                       _openThumb, _decodeThumb, _styleArray, _drawLayer, _imageBounds,
+                       addColorbar)
+
+__all__ = ['animateCollection']
+
+
+def _frameImages(collection):
+    """
+    Get the frames of an animation as a list of ee.Image objects
+    """
+
+    if isinstance(collection,ee.imagecollection.ImageCollection):
+        n = collection.size().getInfo()
+        frames = collection.toList(n)
+        return [ee.Image(frames.get(i)) for i in range(n)]
+
+    return list(collection)
+
+
+def _fetchFrame(imgObj,args,cache=None):
+    """
+    Fetch and decode a frame without keeping it in the in-memory pyramid
+    """
+
+    with closing(_openThumb(imgObj,args,cache)) as stream:
+        t0 = time.time()
+        a = _decodeThumb(stream)
+        instrument.emit('decode',seconds=time.time()-t0-getattr(stream,'readSeconds',0))
+
+    return a
+
+
+def _prefetch(fetch,items,window):
+    """
+    Yield fetch(item) for each item in order, with at most `window` fetches
+    running or waiting to be consumed at once
+    """
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=window) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fetch,item))
+            if len(pending) >= window:
+                break
+
+        while pending:
+            result = pending.popleft().result()
+            for item in items:
+                pending.append(pool.submit(fetch,item))
+                break
+            yield result
+
+
+def animateCollection(collection,outFile,proj=ccrs.PlateCarree(),dims=None,region=None,
+                      cmap=None,visParams=None,labels=None,fps=2,prefetch=4,ax=None,
+                      coastlines=False,colorbar=None,fetchMode='png',reproject=True,
+                      cache=None,writer=None,dpi=None,figsize=None):
+    """
+    Render the images of an ImageCollection as frames of an animation file
+
+    The figure, axes, coastlines and colorbar are created once and only the
+    image data is swapped for each frame. Frames are fetched in the background
+    at most `prefetch` ahead of the frame being encoded and are written to the
+    encoder as they are rendered, so they are never all held in memory.
+
+    Args:
+        collection (ee.imagecollection.ImageCollection | list): Earth Engine collection or list of ee.image.Image frames to animate in order
+        outFile (str): path of the animation file to write. The writer is chosen from the extension, 'pillow' for .gif and 'ffmpeg' otherwise
+        proj (cartopy.crs, optional): Cartopy projection of the map if `ax` is not given. Default is PlateCarree
+        dims (list | tuple | int | str, optional): dimensions to request each frame as [WIDTH,HEIGHT], see addLayer(). Default is 'auto'
+        region (list | tuple, optional): geospatial region to render in format [W,S,E,N]. By default, the bounds of the first frame
+        cmap (str, optional): string specifying matplotlib colormap to colorize the frames. If cmap is specified visParams cannot contain 'palette' key
+        visParams (dict, optional): visualization parameters as a dictionary, used for every frame
+        labels (list, optional): title of each frame. Default None leaves the title empty
+        fps (int, optional): frames per second of the animation. Default is 2
+        prefetch (int, optional): number of frames fetched ahead of the frame being encoded. Default is 4
+        ax (cartopy.mpl.geoaxes.GeoAxesSubplot | cartopy.mpl.geoaxes.GeoAxes, optional): axes to draw the frames on. By default a new figure is created and closed when done
+        coastlines (bool, optional): draw coastlines on the map. Default is False
+        colorbar (dict, optional): keyword arguments for addColorbar(), e.g. {'loc':'right'}. Default None adds no colorbar
+        fetchMode (str, optional): 'png' or 'array', see addLayer(). Default is 'png'
+        reproject (bool, optional): see addLayer(). Default is True
+        cache (cartoee.cache.ThumbCache | bool, optional): on-disk cache for the frames. By default uses the cache set with enableCache() if any, True also enables one if none is set and False disables caching
+        writer (str | matplotlib.animation.AbstractMovieWriter, optional): matplotlib writer name or instance. By default chosen from the extension of `outFile`
+        dpi (float, optional): resolution of the frames. Default is the figure dpi
+        figsize (list | tuple, optional): size in inches of the figure created when `ax` is not given
+
+    Returns:
+        outFile (str): path of the written animation
+
+    Raises:
+        ValueError: If `collection` has no images
+        ValueError: If `labels` does not have one label per frame
+    """
+
+    frames = _frameImages(collection)
+    if not frames:
+        raise ValueError('provided collection has no images')
+
+    if labels is not None and len(labels) != len(frames):
+        raise ValueError('provided labels must have one label per frame')
+
+    if region is None:
+        x,y = list(zip(*_imageBounds(frames[0])[0]))
+        region = [min(x),min(y),max(x),max(y)]
+
+    fig = None
+    if ax is None:
+        fig = plt.figure(figsize=figsize)
+        ax = fig.add_subplot(1,1,1,projection=proj)
+    _checkAxes(ax)
+
+    if writer is None:
+        writer = 'pillow' if os.path.splitext(outFile)[1].lower() == '.gif' else 'ffmpeg'
+    if not isinstance(writer,animation.AbstractMovieWriter):
+        writer = animation.writers[writer](fps=fps)
+
+    # every frame is requested on the same grid so only the data changes
+    args,viewExtent,dims = _layerRequest(ax,frames[0],'auto' if dims is None else dims,
+                                         region,cmap,visParams,fetchMode)
+    if type(dims) not in [list,tuple]:
+        dims = _resolveDims(dims,viewExtent)
+        args['dimensions'] = '{0}x{1}'.format(*dims)
+    serverProj = _serverProjection(ax,args,viewExtent,reproject)
+    localWarp = (reproject and serverProj is None
+                 and not warp.isPlateCarree(ax.projection))
+
+    def fetch(imgObj):
+        a = _fetchFrame(imgObj,args,cache)
+        style = {}
+        if fetchMode == 'array':
+            a,style = _styleArray(a,cmap,visParams)
+        return a,style
+
+    try:
+        image = None
+        title = ax.set_title('')
+
+        with writer.saving(ax.figure,outFile,dpi):
+            for i,(a,style) in enumerate(_prefetch(fetch,frames,max(prefetch,1))):
+                if image is None:
+                    image = _drawLayer(ax,a,viewExtent,reproject,serverProj,**style)
+                    if coastlines:
+                        ax.coastlines()
+                    if colorbar:
+                        colorbar = dict(colorbar)
+                        colorbar.setdefault('visParams',visParams)
+                        if cmap:
+                            colorbar.setdefault('cmap',cmap)
+                        addColorbar(ax,**colorbar)
+                else:
+                    if localWarp:
+                        with instrument.timer('warp'):
+                            a = warp.warpArray(a,viewExtent,ax.projection)[0]
+                    with instrument.timer('imshow'):
+                        image.set_data(a)
+
+                if labels is not None:
+                    title.set_text(labels[i])
+
+                with instrument.timer('savefig'):
+                    writer.grab_frame()
+
+    finally:
+        if fig is not None:
+            plt.close(fig)
+
+    return outFile
@@ -0,0 +1,153 @@
+from __future__ import print_function, division
+import os
+import time
+import traceback
+import multiprocessing
+
+
+__all__ = ['renderBatch']
+
+
+# traceback of a failed worker set up, reported as the error of every job
+# the worker picks up. Raising in a Pool initializer respawns the worker forever
+_initError = None
+
+
+def _initWorker(initKwargs):
+    """
+    Set up a worker process with a non-interactive backend and its own ee session
+    """
+
+    global _initError
+
+    try:
+        import ee
+        import matplotlib
+        matplotlib.use('Agg')
+
+        ee.Initialize(**(initKwargs or {}))
+
+    except Exception:
+        _initError = traceback.format_exc()
+
+    return
+
+
+def _packJob(index,job,outDir):
+    """
+    Convert a job specification into something that can be sent to a worker
+    """
+
+    import ee
+
+    job = dict(job)
+
+    if 'image' not in job:
+        raise KeyError('job {0} does not have an "image" key'.format(index))
+
+    img = job.pop('image')
+    if isinstance(img,ee.image.Image):
+        job['expression'] = img.serialize()
+    else:
+        job['assetId'] = img
+
+    filename = job.pop('filename','map_{0}.png'.format(index))
+    job['path'] = os.path.join(outDir,filename)
+
+    return index,job
+
+
+def _renderJob(packed):
+    """
+    Render a single job to disk, catching any failure so the batch keeps going
+    """
+
+    import ee
+    from .plotting import renderMap
+
+    index,job = packed
+    job = dict(job)
+    path = job.pop('path')
+    result = {'index':index,'path':path,'seconds':None,'error':None}
+
+    if _initError is not None:
+        result['seconds'] = 0.0
+        result['error'] = _initError
+        return result
+
+    t0 = time.time()
+    try:
+        if 'expression' in job:
+            img = ee.Image(ee.deserializer.fromJSON(job.pop('expression')))
+        else:
+            img = ee.Image(job.pop('assetId'))
+
+        # the format is taken from the file extension
+        renderMap(img,format=None,out=path,**job)
+
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    result['seconds'] = time.time() - t0
+
+    return result
+
+
+def renderBatch(jobs,workers=None,out_dir='.',initKwargs=None,callback=None):
+    """
+    Render many maps to files across a pool of worker processes
+
+    Each job is a dictionary with an 'image' key (ee.image.Image or asset id
+    string) and optional 'filename', 'proj', 'figsize', 'dpi', 'title',
+    'coastlines' and 'colorbar' (keyword arguments for addColorbar()) keys.
+    All remaining keys are passed to addLayer(). The output format is taken
+    from the filename extension, e.g. '.png' or '.pdf'.
+
+    Args:
+        jobs (list): list of job dictionaries to render
+        workers (int, optional): number of worker processes. 1 renders in the current process with the current ee session. Default is the number of CPUs
+        out_dir (str, optional): directory to write the rendered maps to. Default is the current directory
+        initKwargs (dict, optional): keyword arguments passed to ee.Initialize() in each worker. If it fails, every job of the worker fails with its traceback
+        callback (callable, optional): function called with each job result as soon as it finishes
+
+    Returns:
+        results (list): one dictionary per job, in job order, with 'index', 'path', 'seconds' and 'error' keys. 'error' is None for successful jobs and the formatted traceback otherwise
+
+    Raises:
+        KeyError: If a job does not have an 'image' key
+    """
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    try:
+        os.makedirs(out_dir)
+    except OSError:
+        if not os.path.isdir(out_dir):
+            raise
+
+    packed = [_packJob(i,job,out_dir) for i,job in enumerate(jobs)]
+
+    results = []
+    if workers <= 1:
+        for item in packed:
+            result = _renderJob(item)
+            if callback:
+                callback(result)
+            results.append(result)
+
+    else:
+        pool = multiprocessing.Pool(processes=workers,initializer=_initWorker,
+                                    initargs=(initKwargs,))
+        try:
+            for result in pool.imap_unordered(_renderJob,packed):
+                if callback:
+                    callback(result)
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+
+    results.sort(key=lambda r: r['index'])
+
+    return results
@@ -0,0 +1,567 @@
+from __future__ import print_function, division
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    from os import replace as _replace
+except ImportError:
+    from os import rename as _replace
+
+__all__ = ['ThumbCache','enableCache','disableCache','setCache','getCache',
+           'setMemoryBudget']
+
+
+def _defaultDirectory():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'),'.cache'))
+    return os.path.join(base,'cartoee','thumbs')
+
+
+def _fileSize(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _requestKey(imgObj,args):
+    blob = json.dumps({'expression':imgObj.serialize(),'args':args},
+                      sort_keys=True,default=str)
+
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class ThumbCache(object):
+    """
+    Content-addressed on-disk cache for Earth Engine thumbnail requests
+
+    Entries are keyed by the serialized Earth Engine expression together with
+    the thumbnail request arguments so a hit skips both the URL minting and
+    the download. The cache is bounded in size with least-recently-used
+    eviction and entries expire after `ttl` seconds. The total size is
+    tracked as entries are written, the directory is only scanned again when
+    it goes over `maxSize`.
+
+    Args:
+        directory (str, optional): directory to store cached files in. Default is ~/.cache/cartoee/thumbs
+        maxSize (int, optional): maximum total size of the cache in bytes. Default is 512 MB
+        ttl (int | float, optional): time in seconds before an entry expires. None disables expiry. Default is 7 days
+    """
+
+    suffix = '.thumb'
+
+    def __init__(self,directory=None,maxSize=512*1024**2,ttl=7*24*3600):
+        self.directory = directory or _defaultDirectory()
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # total size of the entries in bytes, None until the directory is scanned
+        self._size = None
+
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                raise
+
+    def __getstate__(self):
+        # the lock is per process, caches are sent to batch workers without it
+        state = dict(self.__dict__)
+        del state['_lock']
+        # other processes write to the same directory, workers scan it again
+        state['_size'] = None
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(imgObj,args):
+        """
+        Build the cache key for a thumbnail request
+
+        Args:
+            imgObj (ee.image.Image): Earth Engine image the request is made for
+            args (dict): thumbnail request arguments passed to getThumbUrl()
+
+        Returns:
+            key (str): hex digest identifying the request
+        """
+
+        return _requestKey(imgObj,args)
+
+    def _path(self,key):
+        return os.path.join(self.directory,key+self.suffix)
+
+    def _expired(self,path,now):
+        return (self.ttl is not None) and (now - os.path.getmtime(path) > self.ttl)
+
+    def open(self,key):
+        """
+        Open the cached entry for `key` for reading, None on a miss or expired entry
+        """
+
+        path = self._path(key)
+        now = time.time()
+        try:
+            if self._expired(path,now):
+                self.invalidate(key)
+                return None
+
+            f = open(path,'rb')
+
+            # access time tracks recency for eviction, mtime is kept as the
+            # creation time for the ttl
+            os.utime(path,(now,os.path.getmtime(path)))
+
+        except (IOError,OSError):
+            return None
+
+        return f
+
+    def get(self,key):
+        """
+        Return the cached bytes for `key` or None on a miss or expired entry
+        """
+
+        f = self.open(key)
+        if f is None:
+            return None
+
+        with f:
+            return f.read()
+
+    def put(self,key,data):
+        """
+        Store `data` bytes under `key` and evict old entries if over maxSize
+        """
+
+        self._write(key,lambda f: f.write(data))
+        self._evict()
+
+        return
+
+    def store(self,key,stream):
+        """
+        Copy a readable stream into the cache in chunks without holding it in
+        memory and return the stored entry opened for reading
+
+        The returned file stays readable even if the entry is evicted before
+        it is closed.
+        """
+
+        path = self._write(key,lambda f: shutil.copyfileobj(stream,f))
+        f = open(path,'rb')
+        self._evict()
+
+        return f
+
+    def _write(self,key,writer):
+        fd,tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd,'wb') as f:
+                writer(f)
+            path = self._path(key)
+            replaced = _fileSize(path)
+            _replace(tmp,path)
+        except (IOError,OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        self._resized(_fileSize(path)-replaced)
+
+        return path
+
+    def _resized(self,delta):
+        with self._lock:
+            if self._size is not None:
+                self._size += delta
+
+    def invalidate(self,key):
+        """
+        Remove a single entry from the cache if it exists
+        """
+
+        path = self._path(key)
+        size = _fileSize(path)
+        try:
+            os.remove(path)
+        except OSError:
+            return
+
+        self._resized(-size)
+
+        return
+
+    def clear(self):
+        """
+        Remove all entries from the cache
+        """
+
+        for path,_ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        with self._lock:
+            self._size = None
+
+        return
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory,name)
+            try:
+                entries.append((path,os.stat(path)))
+            except OSError:
+                pass
+
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            if self._size is not None and (self.maxSize is None or self._size <= self.maxSize):
+                return
+
+            now = time.time()
+            entries = []
+            total = 0
+            for path,st in self._entries():
+                if (self.ttl is not None) and (now - st.st_mtime > self.ttl):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                entries.append((st.st_atime,st.st_size,path))
+                total += st.st_size
+
+            if self.maxSize is not None and total > self.maxSize:
+                for _,size,path in sorted(entries):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+                    if total <= self.maxSize:
+                        break
+
+            self._size = total
+
+        return
+
+
+# default of arguments where None has a meaning of its own
+_unchanged = object()
+
+
+class PyramidCache(object):
+    """
+    In-memory pyramid of decoded layer arrays at the resolutions fetched so far
+
+    Layers are keyed by the request without its dimensions. A request for a
+    size no larger than an array already held is served by downscaling that
+    array instead of downloading the layer again. Requests without an explicit
+    [WIDTH,HEIGHT] are keyed with their dimensions and only served from the
+    same request. Layers expire `ttl` seconds after they were first fetched.
+
+    The module level `pyramid` is used by every fetch that is not made with
+    cache=False, see setMemoryBudget().
+
+    Args:
+        maxBytes (int, optional): memory budget for all arrays, least recently used layers are dropped first. Default is 256 MB
+        maxLevels (int, optional): maximum number of resolutions to keep per layer, the largest is always kept. Default is 4
+        ttl (int | float, optional): time in seconds before a layer expires. None disables expiry. Default is 1 hour
+    """
+
+    def __init__(self,maxBytes=256*1024**2,maxLevels=4,ttl=3600):
+        self.maxBytes = maxBytes
+        self.maxLevels = maxLevels
+        self.ttl = ttl
+        self._layers = OrderedDict()
+        self._created = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(imgObj,args,exact=False):
+        """
+        Build the key of a layer, all resolutions of a request share the same
+        key. `exact` keeps the dimensions in the key, for requests whose size
+        is only known once fetched. Missing dimensions are kept as None so
+        the key differs from the one shared by all resolutions
+        """
+
+        if exact:
+            args = dict(args,dimensions=args.get('dimensions'))
+        else:
+            args = dict((k,v) for k,v in args.items() if k != 'dimensions')
+
+        return _requestKey(imgObj,args)
+
+    def get(self,key,size,downscale):
+        """
+        Get an array of a layer at `size` [WIDTH,HEIGHT], None if no array at
+        least that large is held. `downscale(a,width,height)` derives smaller
+        levels from larger ones. A size of None gets the largest array
+        """
+
+        with self._lock:
+            if key not in self._layers:
+                return None
+            if self._expired(key):
+                self._drop(key)
+                return None
+            levels = self._layers.pop(key)
+            self._layers[key] = levels
+            if size is None:
+                return levels[max(levels)]
+            width,height = size
+            candidates = [shape for shape in levels
+                          if shape[0] >= height and shape[1] >= width]
+            if not candidates:
+                return None
+            shape = min(candidates)
+            a = levels[shape]
+
+        if shape == (height,width):
+            return a
+
+        a = downscale(a,width,height)
+        self.put(key,a)
+
+        return a
+
+    def put(self,key,a):
+        """
+        Add an array of a layer to the pyramid, arrays larger than the memory
+        budget are not kept. Kept arrays are made read-only as every later
+        request for the layer shares them
+        """
+
+        if a.nbytes > self.maxBytes:
+            return
+
+        a.flags.writeable = False
+
+        with self._lock:
+            levels = self._layers.pop(key,{})
+            if a.shape[:2] in levels:
+                self._size -= levels[a.shape[:2]].nbytes
+            levels[a.shape[:2]] = a
+            self._size += a.nbytes
+            while len(levels) > self.maxLevels:
+                self._size -= levels.pop(min(levels)).nbytes
+            self._layers[key] = levels
+            self._created.setdefault(key,time.time())
+            self._trim()
+
+        return
+
+    def _expired(self,key):
+        # called with the lock held
+        return (self.ttl is not None) and (time.time() - self._created[key] > self.ttl)
+
+    def _drop(self,key):
+        # called with the lock held
+        dropped = self._layers.pop(key)
+        del self._created[key]
+        self._size -= sum(level.nbytes for level in dropped.values())
+
+    def _trim(self):
+        # called with the lock held
+        while self._size > self.maxBytes:
+            self._drop(next(iter(self._layers)))
+
+    def resize(self,maxBytes=None,maxLevels=None,ttl=_unchanged):
+        """
+        Change the memory budget, dropping least recently used layers to fit
+
+        Args:
+            maxBytes (int, optional): new memory budget in bytes. Default None keeps the current budget
+            maxLevels (int, optional): new maximum number of resolutions per layer. Default None keeps the current maximum
+            ttl (int | float, optional): new time in seconds before a layer expires, None disables expiry. By default keeps the current ttl
+        """
+
+        with self._lock:
+            if ttl is not _unchanged:
+                self.ttl = ttl
+            if maxLevels is not None:
+                self.maxLevels = maxLevels
+                for levels in self._layers.values():
+                    while len(levels) > self.maxLevels:
+                        self._size -= levels.pop(min(levels)).nbytes
+            if maxBytes is not None:
+                self.maxBytes = maxBytes
+            self._trim()
+
+        return
+
+    def clear(self):
+        """
+        Remove all layers from the pyramid
+        """
+
+        with self._lock:
+            self._layers.clear()
+            self._created.clear()
+            self._size = 0
+
+        return
+
+
+pyramid = PyramidCache()
+
+
+class SingleFlight(object):
+    """
+    Runs at most one call per key at a time
+
+    Callers asking for a key that is already being computed wait for that
+    call and share its result, or its exception, instead of repeating it.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self,key,func):
+        """
+        Call func() unless a call for `key` is in flight
+
+        Returns:
+            result (object): return value of the call
+            shared (bool): True if the result came from another caller's call
+        """
+
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result(),True
+
+        try:
+            result = func()
+        except BaseException as e:
+            with self._lock:
+                del self._calls[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._calls[key]
+        future.set_result(result)
+
+        return result,False
+
+
+inflight = SingleFlight()
+
+
+def setMemoryBudget(maxBytes,maxLevels=None,ttl=_unchanged):
+    """
+    Set the memory budget of the in-memory cache of decoded layers
+
+    The in-memory cache is always on: decoded arrays are kept in memory so
+    repeated and smaller requests for a layer skip Earth Engine, least
+    recently used layers are dropped first when the budget is exceeded. It is
+    bypassed by fetches made with cache=False, 0 disables it entirely.
+
+    Args:
+        maxBytes (int): memory budget in bytes. Default budget is 256 MB
+        maxLevels (int, optional): maximum number of resolutions kept per layer. Default None keeps the current maximum of 4
+        ttl (int | float, optional): time in seconds before a layer expires, None disables expiry. Default budget is 1 hour, by default keeps the current ttl
+    """
+
+    pyramid.resize(maxBytes,maxLevels,ttl)
+
+    return
+
+_defaultCache = None
+
+
+def setCache(cache):
+    """
+    Set the thumbnail cache used by addLayer() when no cache is passed
+
+    Args:
+        cache (cartoee.cache.ThumbCache | None): cache to use by default. None disables default caching
+    """
+
+    global _defaultCache
+    _defaultCache = cache
+
+    return
+
+
+def getCache():
+    """
+    Get the thumbnail cache used by addLayer() when no cache is passed
+
+    Returns:
+        cache (cartoee.cache.ThumbCache | None): the default cache, None if caching is disabled
+    """
+
+    return _defaultCache
+
+
+def _resolveCache(cache):
+    """
+    Get the ThumbCache to use for a `cache` argument: None is the default
+    cache, True the default cache enabling one if needed and False no cache
+    """
+
+    if cache is None:
+        return getCache()
+    if cache is True:
+        return getCache() or enableCache()
+    if cache is False:
+        return None
+
+    return cache
+
+
+def enableCache(directory=None,maxSize=512*1024**2,ttl=7*24*3600):
+    """
+    Create a ThumbCache and make it the default for addLayer()
+
+    Args:
+        directory (str, optional): directory to store cached files in. Default is ~/.cache/cartoee/thumbs
+        maxSize (int, optional): maximum total size of the cache in bytes. Default is 512 MB
+        ttl (int | float, optional): time in seconds before an entry expires. None disables expiry. Default is 7 days
+
+    Returns:
+        cache (cartoee.cache.ThumbCache): the newly enabled default cache
+    """
+
+    cache = ThumbCache(directory=directory,maxSize=maxSize,ttl=ttl)
+    setCache(cache)
+
+    return cache
+
+
+def disableCache():
+    """
+    Disable the default thumbnail cache used by addLayer()
+    """
+
+    setCache(None)
+
+    return
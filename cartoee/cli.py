@@ -0,0 +1,222 @@
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+try:
+    basestring
+except NameError:
+    # python 3, json and yaml strings are unicode under python 2
+    basestring = str
+
+
+def _readJobs(path):
+    """
+    Read job specifications from a JSON, YAML or JSONL file, '-' reads JSONL from stdin
+
+    A JSON or YAML file holds a single job, a list of jobs or a dictionary with
+    'jobs' and optional 'defaults' keys. Defaults are applied to every job.
+    """
+
+    if path == '-':
+        return [json.loads(line) for line in sys.stdin if line.strip()]
+
+    ext = os.path.splitext(path)[1].lower()
+    with open(path) as f:
+        if ext == '.jsonl':
+            return [json.loads(line) for line in f if line.strip()]
+        elif ext in ['.yaml','.yml']:
+            if yaml is None:
+                raise ValueError('reading YAML job specifications requires PyYAML')
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    if isinstance(spec,dict) and 'jobs' in spec:
+        defaults = spec.get('defaults') or {}
+        return [dict(defaults,**job) for job in spec['jobs']]
+    elif isinstance(spec,dict):
+        return [spec]
+
+    return list(spec)
+
+
+def _projection(value):
+    """
+    Get a cartopy projection from a class name, an 'EPSG:<code>' string or a
+    dictionary with a 'name' key and keyword arguments for the class
+    """
+
+    import cartopy.crs as ccrs
+
+    if isinstance(value,dict):
+        kwargs = dict(value)
+        name = kwargs.pop('name')
+    else:
+        name,kwargs = value,{}
+
+    if name.upper().startswith('EPSG:'):
+        return ccrs.epsg(int(name.split(':')[1]))
+
+    proj = getattr(ccrs,name,None)
+    if proj is None:
+        raise ValueError('provided proj {0!r} is not a cartopy projection'.format(name))
+
+    return proj(**kwargs)
+
+
+def _batchJob(index,spec,cache):
+    """
+    Convert a job specification into a renderBatch() job
+    """
+
+    job = dict(spec)
+
+    if 'asset' not in job:
+        raise KeyError('job {0} does not have an "asset" key'.format(index))
+    job['image'] = job.pop('asset')
+
+    if 'output' in job:
+        job['filename'] = job.pop('output')
+    if 'proj' in job:
+        job['proj'] = _projection(job['proj'])
+    if isinstance(job.get('colorbar'),basestring):
+        job['colorbar'] = {'loc':job['colorbar']}
+    if isinstance(job.get('colorbar'),dict) and job['colorbar'].get('loc') in ['top','bottom']:
+        job['colorbar'].setdefault('orientation','horizontal')
+
+    job.setdefault('cache',cache)
+
+    return job
+
+
+def _makeParents(path):
+    """
+    Create the parent directories of an output path if they do not exist
+    """
+
+    parent = os.path.dirname(path)
+    if not parent:
+        return
+
+    try:
+        os.makedirs(parent)
+    except OSError:
+        if not os.path.isdir(parent):
+            raise
+
+    return
+
+
+def _summary(results,seconds):
+    """
+    Summarize renderBatch() results
+    """
+
+    times = np.array([r['seconds'] for r in results if r['error'] is None])
+    failed = [r for r in results if r['error'] is not None]
+
+    summary = {'jobs':len(results),
+               'failed':len(failed),
+               'seconds':seconds,
+               'results':results}
+    if times.size:
+        summary['mean'] = float(times.mean())
+        summary['p50'] = float(np.percentile(times,50))
+        summary['p90'] = float(np.percentile(times,90))
+        summary['mapsPerSecond'] = float(times.size / seconds)
+
+    return summary
+
+
+def render(argv=None):
+    """
+    Render maps from job specifications, see `cartoee render --help`
+    """
+
+    parser = argparse.ArgumentParser(prog='cartoee render',
+                                     description='Render maps from JSON, YAML or JSONL job '
+                                                 'specifications')
+    parser.add_argument('specs',nargs='+',
+                        help='job specification files, "-" reads JSONL from stdin')
+    parser.add_argument('-w','--workers',type=int,default=None,
+                        help='number of worker processes, default is the number of CPUs')
+    parser.add_argument('-o','--out-dir',default='.',
+                        help='directory relative output paths are written to')
+    parser.add_argument('--cache',default=None,metavar='DIR',
+                        help='thumbnail cache directory, default is ~/.cache/cartoee/thumbs')
+    parser.add_argument('--no-cache',action='store_true',
+                        help='do not cache thumbnails')
+    parser.add_argument('--project',default=None,
+                        help='Google Cloud project passed to ee.Initialize()')
+    parser.add_argument('--summary',default=None,metavar='FILE',
+                        help='write a JSON summary with per job timings to this file')
+    parser.add_argument('-q','--quiet',action='store_true',
+                        help='do not print a line per finished job')
+    args = parser.parse_args(argv)
+
+    from .batch import renderBatch
+    from .cache import ThumbCache
+
+    cache = False if args.no_cache else ThumbCache(args.cache)
+
+    try:
+        specs = [spec for path in args.specs for spec in _readJobs(path)]
+        jobs = [_batchJob(i,spec,cache) for i,spec in enumerate(specs)]
+        for job in jobs:
+            if 'filename' in job:
+                _makeParents(os.path.join(args.out_dir,job['filename']))
+    except (IOError,OSError,ValueError,KeyError) as e:
+        parser.error(str(e))
+
+    def report(result):
+        if args.quiet:
+            return
+        status = 'ok' if result['error'] is None else 'FAILED'
+        print('{0:<6} {1:>8.2f}s {2}'.format(status,result['seconds'],result['path']))
+        sys.stdout.flush()
+
+    initKwargs = {'project':args.project} if args.project else None
+
+    t0 = time.time()
+    results = renderBatch(jobs,workers=args.workers,out_dir=args.out_dir,
+                          initKwargs=initKwargs,callback=report)
+    summary = _summary(results,time.time()-t0)
+
+    for result in results:
+        if result['error'] is not None:
+            print('job {0} ({1}) failed:\n{2}'.format(result['index'],result['path'],
+                                                     result['error']),file=sys.stderr)
+
+    print('{0} maps in {1:.2f}s, {2} failed'.format(summary['jobs'],summary['seconds'],
+                                                   summary['failed']))
+
+    if args.summary:
+        with open(args.summary,'w') as f:
+            json.dump(summary,f,indent=2)
+
+    return 1 if summary['failed'] else 0
+
+
+_commands = {'render':render}
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if not argv or argv[0] not in _commands:
+        print('usage: cartoee {{{0}}} ...'.format(','.join(sorted(_commands))),
+              file=sys.stderr)
+        sys.exit(2)
+
+    sys.exit(_commands[argv[0]](argv[1:]))
@@ -0,0 +1,215 @@
+from __future__ import print_function, division
+import warnings
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import ee
+import shapely
+from shapely.geometry import shape
+from matplotlib.path import Path
+from matplotlib.collections import PathCollection
+import cartopy.crs as ccrs
+
+from . import warp
+from . import instrument
+from .plotting import _checkAxes, _axesPixels
+
+__all__ = ['addFeatures']
+
+_featureCache = OrderedDict()
+_featureLock = threading.Lock()
+_featureCacheSize = 16
+
+
+def _objectArray(geoms):
+    """
+    Build a 1-d object array of geometries, shapely < 2 geometries expose the
+    array interface and np.array() would unpack their coordinates
+    """
+
+    a = np.empty(len(geoms),dtype=object)
+    a[:] = geoms
+
+    return a
+
+
+def _collectionGeometries(fcObj,region=None,pageSize=1000,workers=4):
+    """
+    Fetch the geometries of a collection as shapely geometries in lon/lat
+
+    Only the geometries are requested, in pages of `pageSize` features that
+    are fetched in parallel. Results are memoized per collection and region
+    """
+
+    key = (fcObj.serialize(),None if region is None else tuple(region))
+
+    with _featureLock:
+        if key in _featureCache:
+            geoms = _featureCache.pop(key)
+            _featureCache[key] = geoms
+            instrument.count('features.hit')
+            return geoms
+
+    if region is not None:
+        fcObj = fcObj.filterBounds(ee.Geometry.Rectangle(list(region)))
+    fcObj = fcObj.select([])
+
+    with instrument.timer('features.size'):
+        n = fcObj.size().getInfo()
+
+    def page(offset):
+        with instrument.timer('features.page'):
+            return fcObj.toList(pageSize,offset).getInfo()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pages = list(pool.map(page,range(0,n,pageSize)))
+
+    geoms = _objectArray([shape(feature['geometry']) for features in pages
+                          for feature in features if feature.get('geometry')])
+
+    with _featureLock:
+        _featureCache[key] = geoms
+        while len(_featureCache) > _featureCacheSize:
+            _featureCache.popitem(last=False)
+
+    return geoms
+
+
+def _projectGeometries(geoms,proj):
+    """
+    Project lon/lat geometries into the axes' projection, cutting them at its boundary
+    """
+
+    if warp.isPlateCarree(proj):
+        return geoms
+
+    src = ccrs.PlateCarree()
+
+    return _objectArray([proj.project_geometry(geom,src) for geom in geoms])
+
+
+def _simplify(geoms,tolerance):
+    """
+    Simplify geometries, dropping the ones that collapse below the tolerance
+    """
+
+    if hasattr(shapely,'simplify'):
+        geoms = shapely.simplify(geoms,tolerance,preserve_topology=False)
+        return geoms[~shapely.is_empty(geoms)]
+
+    # shapely < 2 has no vectorized operations
+    geoms = [geom.simplify(tolerance,preserve_topology=False) for geom in geoms]
+    return _objectArray([geom for geom in geoms if not geom.is_empty])
+
+
+def _ringPaths(rings,groups,closed):
+    """
+    Build one path per group of rings or lines from their coordinates
+    """
+
+    coords,index = shapely.get_coordinates(rings,return_index=True)
+
+    # position of the first vertex of each ring and of each group
+    starts = np.searchsorted(index,np.arange(len(rings)))
+    ends = np.append(starts[1:],len(coords))
+    groupStarts = starts[np.searchsorted(groups,np.unique(groups))]
+
+    codes = np.full(len(coords),Path.LINETO,dtype=Path.code_type)
+    codes[starts] = Path.MOVETO
+    if closed:
+        codes[ends-1] = Path.CLOSEPOLY
+
+    return [Path(v,c) for v,c in zip(np.split(coords,groupStarts[1:]),
+                                     np.split(codes,groupStarts[1:]))]
+
+
+def _geometryPaths(geoms):
+    """
+    Convert geometries to matplotlib paths, one compound path per polygon so
+    holes are left unfilled and one path per line
+    """
+
+    if not hasattr(shapely,'get_parts'):
+        # shapely < 2
+        from cartopy.mpl.patch import geos_to_path
+        return [path for geom in geoms for path in geos_to_path(geom)]
+
+    parts = shapely.get_parts(geoms)
+    parts = parts[~shapely.is_empty(parts)]
+    types = shapely.get_type_id(parts)
+
+    paths = []
+
+    polygons = parts[types == shapely.GeometryType.POLYGON]
+    if len(polygons):
+        rings,index = shapely.get_rings(polygons,return_index=True)
+        paths += _ringPaths(rings,index,closed=True)
+
+    lines = parts[(types == shapely.GeometryType.LINESTRING) |
+                  (types == shapely.GeometryType.LINEARRING)]
+    if len(lines):
+        paths += _ringPaths(lines,np.arange(len(lines)),closed=False)
+
+    if np.any(types == shapely.GeometryType.POINT):
+        warnings.warn('point geometries are not drawn by addFeatures')
+
+    return paths
+
+
+def addFeatures(fcObj,ax,region=None,tolerance=0.5,pageSize=1000,workers=4,**kwargs):
+    """
+    Add the geometries of an Earth Engine FeatureCollection to a cartopy plot as vectors
+
+    Geometries are fetched once per collection and region in parallel pages,
+    simplified to the size of a pixel of the axes and drawn as a single
+    PathCollection, so boundaries stay crisp at any resolution without
+    rendering them on the server.
+
+    Args:
+        fcObj (ee.featurecollection.FeatureCollection): Earth Engine collection with the geometries to draw
+        ax (cartopy.mpl.geoaxes.GeoAxesSubplot | cartopy.mpl.geoaxes.GeoAxes): required cartopy GeoAxesSubplot object to add the geometries to
+        region (list | tuple, optional): only fetch features intersecting this region in format [W,S,E,N]. If the axes have no image yet, the view is also set to the region. Default None fetches every feature
+        tolerance (float, optional): simplification tolerance in pixels of the current view at the figure or savefig dpi. 0 disables simplification. Default is 0.5
+        pageSize (int, optional): number of features fetched per request. Default is 1000
+        workers (int, optional): maximum number of pages to fetch at the same time. Default is 4
+        **kwargs: remaining keyword arguments are passed to matplotlib.collections.PathCollection, e.g. edgecolor, facecolor or linewidth. Default is black 0.5 wide lines without fill
+
+    Returns:
+        ax (cartopy.mpl.geoaxes.GeoAxesSubplot): cartopy GeoAxesSubplot object with the geometries displayed
+
+    Raises:
+        ValueError: If `fcObj` is not of type ee.featurecollection.FeatureCollection
+        ValueError: If `ax` if not of type cartopy.mpl.geoaxes.GeoAxesSubplot
+    """
+
+    _checkAxes(ax)
+
+    if not isinstance(fcObj,ee.featurecollection.FeatureCollection):
+        raise ValueError('provided fcObj is not of type ee.featurecollection.FeatureCollection')
+
+    if region is not None and not ax.images:
+        ax.set_extent([region[0],region[2],region[1],region[3]],crs=ccrs.PlateCarree())
+
+    geoms = _collectionGeometries(fcObj,region,pageSize,workers)
+
+    with instrument.timer('project'):
+        geoms = _projectGeometries(geoms,ax.projection)
+
+    if tolerance:
+        xmin,xmax = ax.get_xlim()
+        unitsPerPixel = (xmax-xmin) / _axesPixels(ax)[0]
+        with instrument.timer('simplify'):
+            geoms = _simplify(geoms,tolerance*unitsPerPixel)
+
+    paths = _geometryPaths(geoms)
+
+    kwargs.setdefault('facecolor','none')
+    kwargs.setdefault('edgecolor','black')
+    kwargs.setdefault('linewidth',0.5)
+
+    collection = PathCollection(paths,transform=ax.transData,**kwargs)
+    ax.add_collection(collection,autolim=False)
+
+    return ax
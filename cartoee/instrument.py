@@ -0,0 +1,236 @@
+from __future__ import print_function, division
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+__all__ = ['PipelineStats','addHook','removeHook','collectStats','logEvents']
+
+logger = logging.getLogger('cartoee')
+
+_hooks = []
+_hooksLock = threading.Lock()
+
+
+def addHook(hook):
+    """
+    Register a function called with every pipeline event
+
+    Events are dictionaries with a 'stage' key and 'seconds', 'bytes' or
+    'count' keys depending on the stage. Stages are 'extent' (image bounds
+    lookup), 'mint' (URL minting), 'transfer' (download), 'decode',
+    'warp', 'blend', 'imshow' and 'savefig', addFeatures() adds
+    'features.size', 'features.page', 'project' and 'simplify'. 'cache.hit',
+    'cache.miss', 'bounds.hit', 'pyramid.hit' and 'features.hit' events count
+    cache lookups and 'coalesced' counts requests that shared another
+    thread's download.
+
+    Args:
+        hook (callable): function taking a single event dictionary
+    """
+
+    with _hooksLock:
+        _hooks.append(hook)
+
+    return
+
+
+def removeHook(hook):
+    """
+    Unregister a function added with addHook()
+    """
+
+    with _hooksLock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+    return
+
+
+def enabled():
+    """
+    Check if any hook is registered
+    """
+
+    return bool(_hooks)
+
+
+def emit(stage,**info):
+    """
+    Send an event to all registered hooks
+    """
+
+    if not _hooks:
+        return
+
+    event = dict(info)
+    event['stage'] = stage
+    for hook in list(_hooks):
+        hook(event)
+
+    return
+
+
+def count(stage):
+    """
+    Emit a counter event
+    """
+
+    emit(stage,count=1)
+
+    return
+
+
+@contextmanager
+def timer(stage,**info):
+    """
+    Time the body of a with statement and emit it as an event
+    """
+
+    if not _hooks:
+        yield
+        return
+
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        emit(stage,seconds=time.time()-t0,**info)
+
+
+class CountingStream(object):
+    """
+    Readable stream wrapper that measures bytes read and time spent reading,
+    emitted as a 'transfer' event when closed. `seconds` is added to the
+    reading time, e.g. the time taken to open the stream
+    """
+
+    def __init__(self,stream,seconds=0):
+        self.stream = stream
+        self.bytes = 0
+        self.readSeconds = seconds
+
+    def read(self,n=-1):
+        t0 = time.time()
+        data = self.stream.read(n)
+        self.readSeconds += time.time()-t0
+        self.bytes += len(data)
+
+        return data
+
+    def close(self):
+        self.stream.close()
+        emit('transfer',seconds=self.readSeconds,bytes=self.bytes)
+
+
+class PipelineStats(object):
+    """
+    Collects pipeline events and summarizes them per stage
+
+    Use as a hook with addHook() or through collectStats().
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self,event):
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self,percentiles=(50,90,99)):
+        """
+        Summarize the collected events
+
+        Args:
+            percentiles (list | tuple, optional): latency percentiles to compute per stage. Default is (50,90,99)
+
+        Returns:
+            summary (dict): per stage dictionary with 'count' and, where measured, 'total', 'mean' and 'p<N>' seconds and total 'bytes'
+        """
+
+        with self._lock:
+            events = list(self.events)
+
+        stages = {}
+        for event in events:
+            stages.setdefault(event['stage'],[]).append(event)
+
+        summary = {}
+        for stage,items in stages.items():
+            stats = {'count':sum(item.get('count',1) for item in items)}
+
+            seconds = [item['seconds'] for item in items if 'seconds' in item]
+            if seconds:
+                stats['total'] = float(np.sum(seconds))
+                stats['mean'] = float(np.mean(seconds))
+                for p in percentiles:
+                    stats['p{0}'.format(p)] = float(np.percentile(seconds,p))
+
+            nbytes = [item['bytes'] for item in items if 'bytes' in item]
+            if nbytes:
+                stats['bytes'] = int(np.sum(nbytes))
+
+            summary[stage] = stats
+
+        return summary
+
+    def log(self,level=logging.INFO):
+        """
+        Write the summary to the 'cartoee' logger, one line per stage
+        """
+
+        for stage,stats in sorted(self.summary().items()):
+            logger.log(level,'%s %s',stage,
+                       ' '.join('{0}={1:.4g}'.format(k,v) for k,v in sorted(stats.items())))
+
+        return
+
+    def clear(self):
+        """
+        Remove all collected events
+        """
+
+        with self._lock:
+            self.events = []
+
+        return
+
+
+@contextmanager
+def collectStats():
+    """
+    Collect pipeline events for the body of a with statement
+
+    Yields:
+        stats (cartoee.instrument.PipelineStats): stats object receiving the events
+    """
+
+    stats = PipelineStats()
+    addHook(stats)
+    try:
+        yield stats
+    finally:
+        removeHook(stats)
+
+
+def _logEvent(event):
+    info = ' '.join('{0}={1}'.format(k,v) for k,v in sorted(event.items()) if k != 'stage')
+    logger.debug('%s %s',event['stage'],info)
+
+
+def logEvents(enable=True):
+    """
+    Log every pipeline event to the 'cartoee' logger at DEBUG level
+
+    Args:
+        enable (bool, optional): False stops logging events. Default is True
+    """
+
+    removeHook(_logEvent)
+    if enable:
+        addHook(_logEvent)
+
+    return
@@ -0,0 +1,131 @@
+from __future__ import print_function, division
+import os
+import json
+
+import numpy as np
+
+__all__ = ['Layer']
+
+try:
+    basestring
+except NameError:
+    # python 3, metadata loaded under python 2 holds unicode strings
+    basestring = str
+
+
+class Layer(object):
+    """
+    Fetched Earth Engine image with its georeferencing
+
+    Layers are returned by fetchLayer() and can be drawn with addLayer() any
+    number of times, on any axes and projection, without another request.
+    save() writes the raster as a .npy file with a .json sidecar holding the
+    metadata, load() memory-maps it back so large rasters are read lazily.
+
+    Args:
+        data (numpy.ndarray): image array, (HEIGHT,WIDTH,BANDS) uint8 RGB(A) for fetchMode='png' or band values for fetchMode='array'
+        extent (list | tuple): [W,E,S,N] extent of the image in `crs` units
+        crs (str, optional): Earth Engine crs string of the image grid. Default is 'EPSG:4326'
+        fetchMode (str, optional): 'png' or 'array', how the image was fetched. Default is 'png'
+        visParams (dict, optional): visualization parameters used for the request, applied when drawing 'array' layers
+        cmap (str, optional): matplotlib colormap used for the request
+    """
+
+    version = 1
+
+    def __init__(self,data,extent,crs='EPSG:4326',fetchMode='png',visParams=None,cmap=None):
+        self.data = data
+        self.extent = [float(v) for v in extent]
+        self.crs = crs
+        self.fetchMode = fetchMode
+        self.visParams = dict(visParams or {})
+        self.cmap = cmap
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __repr__(self):
+        return 'Layer(shape={0}, extent={1}, crs={2!r}, fetchMode={3!r})'.format(
+            self.shape,self.extent,self.crs,self.fetchMode)
+
+    @staticmethod
+    def _paths(path):
+        base = path[:-4] if path.endswith('.npy') else path
+        return base+'.npy',base+'.json'
+
+    def metadata(self):
+        """
+        Get the georeferencing and visualization metadata of the layer
+
+        Returns:
+            metadata (dict): dictionary that can be serialized as JSON
+        """
+
+        cmap = self.cmap
+        if cmap is not None and not isinstance(cmap,basestring):
+            cmap = getattr(cmap,'name',None)
+
+        return {'version':self.version,
+                'extent':self.extent,
+                'crs':self.crs,
+                'shape':list(self.shape),
+                'dtype':str(self.data.dtype),
+                'fetchMode':self.fetchMode,
+                'visParams':self.visParams,
+                'cmap':cmap}
+
+    def save(self,path):
+        """
+        Save the layer as a .npy raster and a .json metadata sidecar
+
+        Args:
+            path (str): path of the layer, with or without the .npy extension
+
+        Returns:
+            path (str): path of the .npy file
+        """
+
+        dataPath,metaPath = self._paths(path)
+
+        # rasters fetched with outFile are already in a .npy file
+        filename = getattr(self.data,'filename',None)
+        if not (filename and os.path.abspath(filename) == os.path.abspath(dataPath)):
+            np.save(dataPath,np.asarray(self.data))
+        elif hasattr(self.data,'flush'):
+            self.data.flush()
+
+        with open(metaPath,'w') as f:
+            json.dump(self.metadata(),f,indent=2)
+
+        return dataPath
+
+    @classmethod
+    def load(cls,path,mmap=True):
+        """
+        Load a layer written with save()
+
+        Args:
+            path (str): path of the layer, with or without the .npy extension
+            mmap (bool, optional): memory-map the raster instead of reading it into memory. Default is True
+
+        Returns:
+            layer (cartoee.layer.Layer): the loaded layer
+
+        Raises:
+            ValueError: If the sidecar was written by a newer version
+        """
+
+        dataPath,metaPath = cls._paths(path)
+
+        with open(metaPath) as f:
+            meta = json.load(f)
+
+        if meta.get('version',1) > cls.version:
+            raise ValueError('layer {0} was saved with a newer version of cartoee'.format(path))
+
+        data = np.load(dataPath,mmap_mode='r' if mmap else None)
+
+        return cls(data,meta['extent'],crs=meta.get('crs','EPSG:4326'),
+                   fetchMode=meta.get('fetchMode','png'),visParams=meta.get('visParams'),
+                   cmap=meta.get('cmap'))
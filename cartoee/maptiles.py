@@ -0,0 +1,250 @@
+from __future__ import print_function, division
+import time
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from .cache import inflight, _requestKey, _resolveCache
+from .network import getSession
+from . import instrument
+
+tileSize = 256
+maxLatitude = 85.0511287798066
+
+# request arguments that are not visualization parameters
+_requestKeys = ['format','region','dimensions','crs']
+
+# decoded tiles kept in memory, 256 tiles is 64 MB
+_tileCache = OrderedDict()
+_tileLock = threading.Lock()
+_tileCacheSize = 256
+
+
+def _mercatorY(lat):
+    """
+    Get the Web Mercator y of latitudes as a fraction of the world height from the top
+    """
+
+    lat = np.radians(np.clip(lat,-maxLatitude,maxLatitude))
+
+    return (1 - np.log(np.tan(lat) + 1/np.cos(lat)) / np.pi) / 2
+
+
+def tileZoom(viewExtent,size,maxZoom=20):
+    """
+    Get the lowest zoom level whose tiles are at least as fine as an image of
+    `size` pixels covering a lon/lat extent
+
+    Args:
+        viewExtent (list | tuple): [W,E,S,N] extent of the image
+        size (list | tuple): [WIDTH,HEIGHT] of the image in pixels
+        maxZoom (int, optional): highest zoom level to use. Default is 20
+
+    Returns:
+        zoom (int): zoom level
+    """
+
+    w,e,s,n = viewExtent
+    width,height = size
+
+    # Mercator rows are stretched by 1/cos(lat), least so closest to the equator
+    lat = 0 if s <= 0 <= n else min(abs(s),abs(n),maxLatitude)
+    perDegree = max(width / (e-w), height / (n-s) * np.cos(np.radians(lat)))
+
+    zoom = int(np.ceil(np.log2(perDegree * 360 / tileSize) - 1e-9))
+
+    return min(max(zoom,0),maxZoom)
+
+
+def _tileRange(viewExtent,zoom):
+    """
+    Get the [x0,x1) and [y0,y1) tile indices covering a lon/lat extent,
+    x is not wrapped around the antimeridian
+    """
+
+    w,e,s,n = viewExtent
+    count = 2**zoom
+
+    x0 = int(np.floor((w+180) / 360 * count))
+    x1 = int(np.ceil((e+180) / 360 * count))
+    y0 = int(np.floor(_mercatorY(n) * count))
+    y1 = int(np.ceil(_mercatorY(s) * count))
+
+    return x0,max(x1,x0+1),min(max(y0,0),count-1),min(max(y1,y0+1),count)
+
+
+class _MapId(object):
+    """
+    Map id of an image and visualization, minted on the first tile that is not cached
+    """
+
+    def __init__(self,imgObj,visParams):
+        self.imgObj = imgObj
+        self.visParams = visParams
+        self._mapId = None
+        self._lock = threading.Lock()
+
+    def url(self,z,x,y):
+        with self._lock:
+            if self._mapId is None:
+                with instrument.timer('mint'):
+                    self._mapId = self.imgObj.getMapId(self.visParams)
+
+        fetcher = self._mapId.get('tile_fetcher')
+        if fetcher is not None:
+            return fetcher.format_tile_url(x,y,z)
+
+        # earthengine-api < 0.1.215
+        return 'https://earthengine.googleapis.com/map/{0}/{1}/{2}/{3}?token={4}'.format(
+            self._mapId['mapid'],z,x,y,self._mapId['token'])
+
+
+def _openTile(mapId,key,z,x,y,cache):
+    """
+    Open a readable stream of a tile, from the cache when possible
+    """
+
+    if cache:
+        stream = cache.open(key)
+        if stream is not None:
+            instrument.count('cache.hit')
+            return stream
+        instrument.count('cache.miss')
+
+    url = mapId.url(z,x,y)
+
+    t0 = time.time()
+    stream = getSession().open(url)
+    if instrument.enabled():
+        stream = instrument.CountingStream(stream,time.time()-t0)
+
+    if cache:
+        with closing(stream):
+            stream = cache.store(key,stream)
+
+    return stream
+
+
+def _cachedTile(key):
+    with _tileLock:
+        if key not in _tileCache:
+            return None
+        a = _tileCache.pop(key)
+        _tileCache[key] = a
+
+    instrument.count('tiles.hit')
+
+    return a
+
+
+def _keepTile(key,a):
+    a.flags.writeable = False
+    with _tileLock:
+        _tileCache[key] = a
+        while len(_tileCache) > _tileCacheSize:
+            _tileCache.popitem(last=False)
+
+
+def _fetchTile(mapId,z,x,y,cache,memory=True):
+    """
+    Fetch and decode a tile as a (256,256,4) uint8 array, identical tiles
+    requested at the same time from several threads share one download.
+    With `memory` decoded tiles are kept in an in-process LRU
+    """
+
+    key = _requestKey(mapId.imgObj,{'visParams':mapId.visParams,'tile':[z,x,y]})
+
+    if memory:
+        a = _cachedTile(key)
+        if a is not None:
+            return a
+
+    def fetch():
+        with closing(_openTile(mapId,key,z,x,y,cache)) as stream:
+            data = stream.read()
+            t0 = time.time()
+            a = np.asarray(Image.open(BytesIO(data)).convert('RGBA'))
+            instrument.emit('decode',seconds=time.time()-t0)
+        if memory:
+            _keepTile(key,a)
+        return a
+
+    a,shared = inflight.do(('tile',key),fetch)
+    if shared:
+        instrument.count('coalesced')
+
+    return a
+
+
+def mapParams(args):
+    """
+    Get the getMapId() visualization parameters from thumbnail request arguments
+    """
+
+    return {key:value for key,value in args.items() if key not in _requestKeys}
+
+
+def fetchMosaic(imgObj,visParams,viewExtent,size,cache=None,workers=8,maxZoom=20):
+    """
+    Render a lon/lat image from Earth Engine map tiles
+
+    The zoom level is the lowest one at least as fine as `size`, the tiles
+    covering the extent are fetched in parallel and the Web Mercator mosaic is
+    resampled to the lon/lat grid of the extent. Pixels beyond the latitude
+    limit of the tiles are transparent. Decoded tiles are kept in memory so
+    overlapping maps in the same process only fetch the tiles they add, a
+    thumbnail cache also keeps them across processes.
+
+    Args:
+        imgObj (ee.image.Image): Earth Engine image to render
+        visParams (dict): visualization parameters passed to getMapId()
+        viewExtent (list | tuple): [W,E,S,N] extent of the image
+        size (list | tuple): [WIDTH,HEIGHT] of the image in pixels
+        cache (cartoee.cache.ThumbCache | bool, optional): on-disk cache for the tiles. By default uses the cache set with enableCache() if any, True also enables one if none is set and False disables caching including the in-memory tiles
+        workers (int, optional): maximum number of tiles to fetch at the same time. Default is 8
+        maxZoom (int, optional): highest zoom level to use. Default is 20
+
+    Returns:
+        a (numpy.ndarray): (HEIGHT,WIDTH,4) uint8 image
+    """
+
+    memory = cache is not False
+    cache = _resolveCache(cache)
+
+    width,height = [int(v) for v in size]
+    w,e,s,n = viewExtent
+
+    zoom = tileZoom(viewExtent,size,maxZoom)
+    x0,x1,y0,y1 = _tileRange(viewExtent,zoom)
+    count = 2**zoom
+
+    mapId = _MapId(imgObj,visParams)
+
+    def fetch(tile):
+        x,y = tile
+        return x,y,_fetchTile(mapId,zoom,x % count,y,cache,memory)
+
+    mosaic = np.zeros(((y1-y0)*tileSize,(x1-x0)*tileSize,4),dtype=np.uint8)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tiles = [(x,y) for y in range(y0,y1) for x in range(x0,x1)]
+        for x,y,tile in pool.map(fetch,tiles):
+            row,col = (y-y0)*tileSize,(x-x0)*tileSize
+            mosaic[row:row+tileSize,col:col+tileSize] = tile
+
+    # x is linear in longitude, rows only depend on latitude
+    lons = w + (e-w) * (np.arange(width)+0.5) / width
+    lats = n - (n-s) * (np.arange(height)+0.5) / height
+    cols = np.floor(((lons+180) / 360 * count - x0) * tileSize).astype(int)
+    rows = np.floor((_mercatorY(lats) * count - y0) * tileSize).astype(int)
+    cols = np.clip(cols,0,mosaic.shape[1]-1)
+    rows = np.clip(rows,0,mosaic.shape[0]-1)
+
+    out = mosaic[np.ix_(rows,cols)]
+    out[np.abs(lats) > maxLatitude] = 0
+
+    return out
@@ -0,0 +1,174 @@
+from __future__ import print_function, division
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+__all__ = ['ThumbSession','configureSession','getSession','setSession']
+
+
+def _retry(retries,backoff,statuses):
+    kwargs = dict(total=retries,connect=retries,read=retries,status=retries,
+                  backoff_factor=backoff,status_forcelist=statuses,
+                  respect_retry_after_header=True,raise_on_status=False)
+    try:
+        return Retry(allowed_methods=frozenset(['GET']),**kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=frozenset(['GET']),**kwargs)
+
+
+class _Response(object):
+    """
+    Readable stream over a response body that releases its request slot when closed
+    """
+
+    def __init__(self,response,release):
+        self.response = response
+        self._release = release
+        self._closed = False
+
+    def read(self,n=-1):
+        if n is None or n < 0:
+            return self.response.raw.read(decode_content=True)
+        return self.response.raw.read(n,decode_content=True)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.response.close()
+        finally:
+            self._release()
+
+
+class ThumbSession(object):
+    """
+    Shared HTTP session for thumbnail downloads
+
+    Connections are pooled and kept alive between requests, requests time out
+    instead of hanging, failed connections and 429/5xx responses are retried
+    with exponential backoff, and at most `maxConcurrent` requests are open
+    at once in the process.
+
+    Args:
+        poolSize (int, optional): number of keep-alive connections kept per host. Default is 10
+        connectTimeout (float, optional): seconds to wait for a connection. Default is 10
+        readTimeout (float, optional): seconds to wait for data between reads. Default is 60
+        retries (int, optional): number of retries for failed requests. Default is 3
+        backoff (float, optional): backoff factor in seconds, retry n waits backoff * 2 ** (n - 1). Default is 0.5
+        maxConcurrent (int, optional): maximum number of requests open at the same time. Default is 8
+        retryStatuses (list | tuple, optional): HTTP status codes to retry. Default is (429,500,502,503,504)
+    """
+
+    def __init__(self,poolSize=10,connectTimeout=10,readTimeout=60,retries=3,backoff=0.5,
+                 maxConcurrent=8,retryStatuses=(429,500,502,503,504)):
+        self.timeout = (connectTimeout,readTimeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.retryStatuses = tuple(retryStatuses)
+        self._slots = threading.BoundedSemaphore(maxConcurrent)
+
+        adapter = HTTPAdapter(pool_connections=poolSize,pool_maxsize=poolSize,
+                              max_retries=_retry(retries,backoff,retryStatuses))
+        self._session = requests.Session()
+        self._session.mount('http://',adapter)
+        self._session.mount('https://',adapter)
+
+    def open(self,url):
+        """
+        Open a url and return a readable stream of the response body
+
+        The stream holds one of the concurrent request slots until it is closed.
+
+        Args:
+            url (str): url to request
+
+        Returns:
+            stream (object): readable stream with read() and close() methods
+
+        Raises:
+            requests.HTTPError: If the response status is still an error after retries
+        """
+
+        self._slots.acquire()
+        try:
+            response = self._session.get(url,stream=True,timeout=self.timeout)
+            response.raise_for_status()
+        except Exception:
+            self._slots.release()
+            raise
+
+        return _Response(response,self._slots.release)
+
+    def get(self,url):
+        """
+        Download a url and return the response body as bytes
+        """
+
+        stream = self.open(url)
+        try:
+            return stream.read()
+        finally:
+            stream.close()
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+
+        self._session.close()
+
+
+_session = None
+_sessionLock = threading.Lock()
+
+
+def getSession():
+    """
+    Get the session used for thumbnail downloads, created on first use
+
+    Returns:
+        session (cartoee.network.ThumbSession): the shared session
+    """
+
+    global _session
+    with _sessionLock:
+        if _session is None:
+            _session = ThumbSession()
+
+    return _session
+
+
+def setSession(session):
+    """
+    Set the session used for thumbnail downloads
+
+    Args:
+        session (cartoee.network.ThumbSession): session to share
+    """
+
+    global _session
+    with _sessionLock:
+        _session = session
+
+    return
+
+
+def configureSession(**kwargs):
+    """
+    Replace the shared session with one created with the given settings
+
+    Args:
+        **kwargs: keyword arguments passed to ThumbSession()
+
+    Returns:
+        session (cartoee.network.ThumbSession): the new shared session
+    """
+
+    session = ThumbSession(**kwargs)
+    setSession(session)
+
+    return session
@@ -0,0 +1,73 @@
+from __future__ import print_function, division
+import binascii
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import matplotlib as mpl
+from matplotlib import cm, colors
+
+__all__ = ['buildPalette']
+
+
+_paletteCache = OrderedDict()
+_paletteLock = threading.Lock()
+_paletteCacheSize = 64
+
+
+def _getColormap(cmap,n):
+    """
+    Get a matplotlib colormap resampled to n colors
+    """
+
+    try:
+        if isinstance(cmap,colors.Colormap):
+            return cmap.resampled(n)
+        return mpl.colormaps[cmap].resampled(n)
+    except AttributeError:
+        return cm.get_cmap(cmap, n)
+    except KeyError:
+        # the registry raises KeyError, keep the ValueError of cm.get_cmap()
+        raise ValueError('{0!r} is not a known colormap name'.format(cmap))
+
+
+def buildPalette(cmap,n=256):
+    """
+    Creates hex color code palette from a matplotlib colormap
+
+    Palettes are computed with one vectorized colormap call and the most
+    recently used ones are memoized per (cmap, n), so repeated calls are free
+
+    Args:
+        cmap (str): string specifying matplotlib colormap to colorize image. If cmap is specified visParams cannot contain 'palette' key
+        n (int, optional): Number of hex color codes to create from colormap. Default is 256
+
+    Returns:
+        palette (list): list of hex color codes from matplotlib colormap for n intervals
+
+    Raises:
+        ValueError: If cmap is not a known colormap name
+    """
+
+    # colormap objects are not hashable, only names are memoized
+    key = None if isinstance(cmap,colors.Colormap) else (cmap,n)
+    with _paletteLock:
+        if key in _paletteCache:
+            palette = _paletteCache.pop(key)
+            _paletteCache[key] = palette
+            return list(palette)
+
+    colormap = _getColormap(cmap, n)
+    rgb = colormap(np.linspace(0,1,n))[:,:3]
+    rgb = np.round(rgb*255).astype(np.uint8)
+
+    hexstr = binascii.hexlify(rgb.tobytes()).decode('ascii')
+    palette = ['#'+hexstr[i:i+6] for i in range(0,len(hexstr),6)]
+
+    if key is not None:
+        with _paletteLock:
+            _paletteCache[key] = tuple(palette)
+            while len(_paletteCache) > _paletteCacheSize:
+                _paletteCache.popitem(last=False)
+
+    return palette
@@ -1,20 +1,32 @@
 from __future__ import print_function, division
 import ee
+import copy
+import time
 import warnings
+import threading
+from io import BytesIO
+from contextlib import closing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import matplotlib as mpl
-from matplotlib import cm, colors
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.axes._axes import Axes
-
-try:
-    from urllib2 import urlopen
-except ImportError:
-    from urllib.request import urlopen
+from PIL import Image, ImageFile
 
 import cartopy.crs as ccrs
 from cartopy.mpl.geoaxes import GeoAxes,GeoAxesSubplot
 
+from .palette import buildPalette
+from .layer import Layer
+from .cache import pyramid, inflight, _resolveCache
+from .network import getSession
+from . import warp
+from . import maptiles
+from . import instrument
+
 
 def getMap(imgObj,proj=ccrs.PlateCarree(),**kwargs):
     """
@@ -22,31 +34,241 @@ def getMap(imgObj,proj=ccrs.PlateCarree(),**kwargs):
     Engine image results
 
     Args:
-        imgObj (ee.image.Image): Earth Engine image result to plot
+        imgObj (ee.image.Image | list): Earth Engine image result to plot, or a list of layers to composite with addLayers()
         proj (cartopy.crs, optional): Cartopy projection that determines the projection of the resulting plot. By default uses an equirectangular projection, PlateCarree
-        **kwargs: remaining keyword arguments are passed to addLayer()
+        **kwargs: remaining keyword arguments are passed to addLayer(), or addLayers() if `imgObj` is a list
 
     Returns:
         ax (cartopy.mpl.geoaxes.GeoAxesSubplot): cartopy GeoAxesSubplot object with Earth Engine results displayed
     """
 
     ax = plt.axes(projection=proj)
-    ax = addLayer(imgObj,ax=ax,**kwargs)
+    if type(imgObj) in [list,tuple]:
+        ax = addLayers(imgObj,ax=ax,**kwargs)
+    else:
+        ax = addLayer(imgObj,ax=ax,**kwargs)
 
     return ax
 
 
-def addLayer(imgObj,ax,dims=None,region=None,cmap=None,visParams=None):
+def getMapGrid(images,ncols=3,proj=ccrs.PlateCarree(),visParams=None,cmap=None,region=None,
+               dims=None,titles=None,colorbar=None,coastlines=False,figsize=None,
+               fetchMode='png',cache=None,workers=8,reproject=True):
+    """
+    Create a figure with a grid of maps, one per image, sharing one extent and one colorbar
+
+    All panels are requested on the same extent and pixel grid and fetched
+    at the same time, then drawn on a single figure.
+
+    Args:
+        images (list | ee.imagecollection.ImageCollection): Earth Engine images to plot, one panel each, filled row by row
+        ncols (int, optional): number of panel columns. Default is 3
+        proj (cartopy.crs, optional): Cartopy projection of every panel. Default is PlateCarree
+        visParams (dict, optional): visualization parameters as a dictionary, shared by all panels
+        cmap (str, optional): string specifying matplotlib colormap to colorize the images. If cmap is specified visParams cannot contain 'palette' key
+        region (list | tuple, optional): geospatial region to render in format [W,S,E,N]. By default, the bounds of the first image
+        dims (list | tuple | int | str, optional): dimensions to request each panel as [WIDTH,HEIGHT], see addLayer(). Default is 'auto'
+        titles (list, optional): title of each panel. Default None
+        colorbar (str | dict, optional): location, "left", "top", "right" or "bottom", or keyword arguments for colorbar() with a 'loc' key of one colorbar shared by all panels. Default None adds no colorbar
+        coastlines (bool, optional): draw coastlines on every panel. Default is False
+        figsize (list | tuple, optional): size of the figure in inches. Default is the matplotlib default figure size
+        fetchMode (str, optional): 'png' or 'array', see addLayer(). With 'array' and no "min"/"max" in visParams, all panels share the range of the values of all images. Default is 'png'
+        cache (cartoee.cache.ThumbCache | bool, optional): on-disk cache for the thumbnails, see addLayer()
+        workers (int, optional): maximum number of panels to fetch at the same time. Default is 8
+        reproject (bool, optional): see addLayer(). Default is True
+
+    Returns:
+        fig (matplotlib.figure.Figure): figure holding the grid
+        axes (numpy.ndarray): (ROWS,COLUMNS) array of cartopy GeoAxes, panels without an image are hidden
+
+    Raises:
+        ValueError: If `images` is empty
+        ValueError: If `titles` does not have one title per image
+        ValueError: If the colorbar location is not one of the available options
+    """
+
+    if not isinstance(images,(list,tuple)):
+        from .animate import _frameImages
+        images = _frameImages(images)
+    images = list(images)
+    if not images:
+        raise ValueError('provided images is empty')
+
+    if titles is not None and len(titles) != len(images):
+        raise ValueError('provided titles must have one title per image')
+
+    if region is None:
+        x,y = list(zip(*_imageBounds(images[0])[0]))
+        region = [min(x),min(y),max(x),max(y)]
+
+    nrows = int(np.ceil(len(images) / ncols))
+    fig = plt.figure(figsize=figsize)
+    axes = np.empty((nrows,ncols),dtype=object)
+    for i in range(nrows*ncols):
+        axes.flat[i] = fig.add_subplot(nrows,ncols,i+1,projection=proj)
+        if i >= len(images):
+            axes.flat[i].set_visible(False)
+
+    if colorbar:
+        colorbar = {'loc':colorbar} if type(colorbar) == str else dict(colorbar)
+        loc = colorbar.pop('loc',None)
+        cax = _gridColorbarAxes(fig,loc)
+        if loc in ['bottom','top']:
+            colorbar.setdefault('orientation','horizontal')
+
+    # the request is the same for every panel except for the image
+    ax = axes.flat[0]
+    args,viewExtent,dims = _layerRequest(ax,images[0],'auto' if dims is None else dims,
+                                         region,cmap,visParams,fetchMode)
+    serverProj = _serverProjection(ax,args,viewExtent,reproject)
+
+    def fetch(imgObj):
+        return _fetchArray(imgObj,args,cache)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        arrays = list(pool.map(fetch,images))
+
+    panelVis = dict(visParams or {})
+    if fetchMode == 'array' and (arrays[0].ndim == 2 or arrays[0].shape[-1] == 1):
+        # one colorbar, so every panel gets the same range
+        if 'min' not in panelVis:
+            panelVis['min'] = float(min(np.nanmin(a) for a in arrays))
+        if 'max' not in panelVis:
+            panelVis['max'] = float(max(np.nanmax(a) for a in arrays))
+
+    for i,a in enumerate(arrays):
+        ax = axes.flat[i]
+        style = {}
+        if fetchMode == 'array':
+            a,style = _styleArray(a,cmap,panelVis)
+
+        _drawLayer(ax,a,viewExtent,reproject,serverProj,**style)
+
+        if coastlines:
+            ax.coastlines()
+        if titles is not None:
+            ax.set_title(titles[i])
+
+    if colorbar:
+        if cmap:
+            colorbar.setdefault('cmap',cmap)
+        _drawColorbar(cax,panelVis,colorbar.pop('discrete',False),axes.flat[0],**colorbar)
+
+    return fig,axes
+
+
+_gridColorbarPositions = {'left':   ({'left':0.14},  [0.05, 0.2, 0.02, 0.6]),
+                          'right':  ({'right':0.86}, [0.89, 0.2, 0.02, 0.6]),
+                          'bottom': ({'bottom':0.14},[0.2, 0.07, 0.6, 0.025]),
+                          'top':    ({'top':0.86},   [0.2, 0.92, 0.6, 0.025])}
+
+
+def _gridColorbarAxes(fig,loc):
+    """
+    Make room for and add the axes of a colorbar shared by all panels of a figure
+    """
+
+    if loc not in _gridColorbarPositions:
+        raise ValueError('provided loc not of type str. options are "left", '
+                         '"top", "right", or "bottom"')
+
+    adjust,position = _gridColorbarPositions[loc]
+    fig.subplots_adjust(**adjust)
+    cax = fig.add_axes(position)
+
+    return cax
+
+
+def renderMap(imgObj,proj=ccrs.PlateCarree(),figsize=None,dpi=None,format='png',
+              title=None,coastlines=False,colorbar=None,out=None,**kwargs):
+    """
+    Render a map to an image without pyplot
+
+    The map is drawn on its own Figure with an Agg canvas that is never
+    registered with pyplot, so maps can be rendered from many threads at once
+    and the figure is freed as soon as the map is saved.
+
+    Args:
+        imgObj (ee.image.Image | list): Earth Engine image result to plot, or a list of layers to composite with addLayers()
+        proj (cartopy.crs, optional): Cartopy projection that determines the projection of the resulting plot. By default uses an equirectangular projection, PlateCarree
+        figsize (list | tuple, optional): size of the figure in inches. Default is the matplotlib default figure size
+        dpi (float, optional): resolution of the figure. Default is the matplotlib default figure dpi
+        format (str, optional): image format to save the map as, e.g. 'png', 'jpg' or 'pdf'. None infers it from the extension of `out`. Default is 'png'
+        title (str, optional): title of the map. Default None
+        coastlines (bool, optional): draw coastlines on the map. Default is False
+        colorbar (str | dict, optional): colorbar location or keyword arguments for addColorbar(). The layer's visParams and cmap are used by default. Default None adds no colorbar
+        out (str | file, optional): path or writable file to save the map to. Default None returns the encoded image
+        **kwargs: remaining keyword arguments are passed to addLayer(), or addLayers() if `imgObj` is a list
+
+    Returns:
+        out (bytes | str | file): the encoded image if `out` is None, otherwise `out`
+    """
+
+    fig,ax = _newMap(proj,figsize,dpi)
+
+    try:
+        if type(imgObj) in [list,tuple]:
+            addLayers(imgObj,ax,**kwargs)
+        else:
+            addLayer(imgObj,ax,**kwargs)
+
+        refineLayers(ax)
+
+        if coastlines:
+            ax.coastlines()
+        if title:
+            ax.set_title(title)
+        if colorbar:
+            colorbar = {'loc':colorbar} if type(colorbar) == str else dict(colorbar)
+            colorbar.setdefault('visParams',kwargs.get('visParams'))
+            if kwargs.get('cmap'):
+                colorbar.setdefault('cmap',kwargs['cmap'])
+            addColorbar(ax,**colorbar)
+
+        buf = BytesIO() if out is None else out
+        with instrument.timer('savefig'):
+            fig.savefig(buf,format=format)
+
+    finally:
+        # break the figure's reference cycles so it is freed right away
+        fig.clear()
+
+    return buf.getvalue() if out is None else out
+
+
+def _newMap(proj,figsize=None,dpi=None):
+    """
+    Create a Figure on its own Agg canvas with a single map axes, without pyplot
+    """
+
+    fig = Figure(figsize=figsize,dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1,1,1,projection=proj)
+
+    return fig,ax
+
+
+def addLayer(imgObj,ax,dims=None,region=None,cmap=None,visParams=None,cache=None,
+             tiles=None,workers=4,fetchMode='png',outFile=None,reproject=True,
+             progressive=None,source='thumb'):
     """
     Add an Earth Engine image to a cartopy plot.
 
     Args:
-        imgObj (ee.image.Image): Earth Engine image result to plot.
+        imgObj (ee.image.Image | cartoee.layer.Layer): Earth Engine image result to plot, or a layer from fetchLayer() or Layer.load() which is drawn without a request. Only `cmap`, `visParams` and `reproject` apply to layers
         ax (cartopy.mpl.geoaxes.GeoAxesSubplot | cartopy.mpl.geoaxes.GeoAxes): required cartopy GeoAxesSubplot object to add image overlay to
-        dims (list | tuple | int, optional): dimensions to request earth engine result as [WIDTH,HEIGHT]. If only one number is passed, it is used as the maximum, and the other dimension is computed by proportional scaling. Default None and infers dimesions
-        region (list | tuple, optional): geospatial region of the image to render in format [E,S,W,N]. By default, the whole image
+        dims (list | tuple | int | str, optional): dimensions to request earth engine result as [WIDTH,HEIGHT]. If only one number is passed, it is used as the maximum, and the other dimension is computed by proportional scaling. 'auto' computes the dimensions from the size of `ax` in pixels at the figure or savefig dpi, whichever is larger. Default None and infers dimesions
+        region (list | tuple, optional): geospatial region of the image to render in format [W,S,E,N]. By default, the whole image
         cmap (str, optional): string specifying matplotlib colormap to colorize image. If cmap is specified visParams cannot contain 'palette' key
         visParams (dict, optional): visualization parameters as a dictionary. See https://developers.google.com/earth-engine/image_visualization for options
+        cache (cartoee.cache.ThumbCache | bool, optional): on-disk cache for the thumbnail. By default uses the cache set with enableCache() if any, True also enables one if none is set and False disables caching including the in-memory cache of decoded arrays, see setMemoryBudget()
+        tiles (int | list | tuple, optional): fetch the image as a grid of tiles to get past the Earth Engine thumbnail size limit. An int n requests n x n tiles, a pair is used as [COLUMNS,ROWS]. Requires `dims`. Default None fetches a single thumbnail
+        workers (int, optional): maximum number of tiles to fetch at the same time. Default is 4
+        fetchMode (str, optional): 'png' requests an image colorized by Earth Engine. 'array' requests the raw band values and applies `cmap`, "palette", "min", "max" and "gamma" locally, so the layer can be restyled with `set_cmap()`/`set_clim()` on the returned image without another request. Default is 'png'
+        outFile (str, optional): path of a .npy file to decode the image into as a memory-mapped array, for very large renders. With fetchMode='array' the image is streamed into the file and never held in memory, PNGs are decoded in memory before being copied. Default None
+        reproject (bool, optional): for axes not in PlateCarree, request the image in the axes' projection when it has an EPSG code, otherwise warp it once with source indices cached per extent, shape and projection. False lets cartopy reproject the image on every imshow. Default is True
+        progressive (int, optional): first draw a preview at most this many pixels wide or high, then fetch the full resolution image in the background and swap it into the same image. Interactive backends refine the map on their own, call refineLayers() before saving from them. Non-interactive backends such as Agg and the notebook inline backend wait for the full resolution image when the figure is drawn or saved. Default None draws the full resolution image directly
+        source (str, optional): 'thumb' renders the image with a thumbnail request. 'tiles' mosaics Earth Engine map tiles at the zoom level matching `dims`, or the size of `ax` when dims is None, keeping decoded tiles in memory so overlapping maps reuse them, see maptiles.fetchMosaic(). 'tiles' only supports fetchMode='png' and ignores `tiles`. Default is 'thumb'
 
     Returns:
         ax (cartopy.mpl.geoaxes.GeoAxesSubplot): cartopy GeoAxesSubplot object with Earth Engine results displayed
@@ -55,183 +277,1361 @@ def addLayer(imgObj,ax,dims=None,region=None,cmap=None,visParams=None):
         ValueError: If `dims` is not of type list, tuple, or int
         ValueError: If `imgObj` is not of type ee.image.Image
         ValueError: If `ax` if not of type cartopy.mpl.geoaxes.GeoAxesSubplot '
+        ValueError: If `tiles` is used without `dims`
+        ValueError: If `fetchMode` is not 'png' or 'array'
+        ValueError: If `source` is not 'thumb' or 'tiles', or is 'tiles' with fetchMode='array'
     """
 
-    if type(imgObj) != ee.image.Image:
-        raise ValueError("provided imgObj is not of type ee.image.Image")
+    _checkAxes(ax)
 
-    if region:
-        mapRegion = ee.Geometry.Rectangle(region).getInfo()['coordinates']
-        viewExtent = (region[0],region[2],region[1],region[3])
-    else:
-        mapRegion = imgObj.geometry().bounds().getInfo()['coordinates']
-        x,y = list(zip(*mapRegion[0]))
-        viewExtent = [min(x),max(x),min(y),max(y)]
+    if isinstance(imgObj,Layer):
+        return _addStoredLayer(imgObj,ax,cmap,visParams,reproject)
 
-    if type(dims) == None and type(dims) not in [list,tuple,int]:
-        raise ValueError('provided dims not of type list, tuple, or int')
+    if source not in ['thumb','tiles']:
+        raise ValueError('provided source must be "thumb" or "tiles"')
+    if source == 'tiles' and fetchMode != 'png':
+        raise ValueError('map tiles can only be fetched with fetchMode="png"')
 
-    if type(ax) not in [GeoAxes,GeoAxesSubplot]:
-        raise ValueError('provided axes not of type cartopy.mpl.geoaxes.GeoAxes '
-                         'or cartopy.mpl.geoaxes.GeoAxesSubplot')
+    if source == 'tiles' and dims is None:
+        dims = 'auto'
 
-    args = {'format':'png'}
-    if region:
-        args['region'] = mapRegion
-    if dims:
-        args['dimensions'] = dims
+    args,viewExtent,dims = _layerRequest(ax,imgObj,dims,region,cmap,visParams,fetchMode)
+    serverProj = _serverProjection(ax,args,viewExtent,
+                                   reproject and not tiles and source == 'thumb')
 
-    if visParams:
-        keys = list(visParams.keys())
-        if cmap and ('palette' in keys):
-            raise KeyError('cannot provide "palette" in visParams if cmap is specified')
-        elif cmap:
-            args['palette'] = ','.join(buildPalette(cmap))
+    def fetch(args,full=True):
+        if source == 'tiles':
+            a = _fetchMosaic(imgObj,args,viewExtent,workers,cache,outFile if full else None)
+        elif full and tiles:
+            a = _fetchTiled(imgObj,args,viewExtent,dims,tiles,workers,cache,outFile)
         else:
-            pass
+            a = _fetchArray(imgObj,args,cache,outFile if full else None)
 
-        for key in keys:
-            args[key] = visParams[key]
+        style = {}
+        if fetchMode == 'array':
+            a,style = _styleArray(a,cmap,visParams)
+
+        return a,style
+
+    if progressive and _previewSmaller(args,progressive):
+        previewArgs = dict(args)
+        previewArgs['dimensions'] = int(progressive)
+        a,style = fetch(previewArgs,full=False)
+
+        image = _drawLayer(ax,a,viewExtent,reproject,serverProj,**style)
+
+        # the full image keeps the colormap and norm of the preview
+        _refine(image,lambda: fetch(args)[0],viewExtent,reproject and serverProj is None)
 
-    url = imgObj.getThumbUrl(args)
-    img = urlopen(url)
-    a = plt.imread(img)
+        return ax
 
-    ax.imshow(a, extent=viewExtent,origin='upper',transform=ccrs.PlateCarree())
+    a,style = fetch(args)
+
+    _drawLayer(ax,a,viewExtent,reproject,serverProj,**style)
 
     return ax
 
-def buildPalette(cmap,n=256):
+
+_refineExecutor = None
+_refineLock = threading.Lock()
+
+
+class _Refinement(object):
+    """
+    Full resolution image being fetched in the background for a preview
+    """
+
+    def __init__(self,image,future):
+        self.image = image
+        self.future = future
+        self.applied = False
+        self._lock = threading.Lock()
+
+    def apply(self,timeout=None):
+        """
+        Wait for the full resolution image and swap it into the preview
+        """
+
+        a = self.future.result(timeout)
+        with self._lock:
+            if not self.applied:
+                self.image.set_data(a)
+                self.applied = True
+
+        return
+
+    def poll(self,timer):
+        """
+        Timer callback swapping the image in once it is fetched
+        """
+
+        if not self.future.done():
+            return
+
+        timer.stop()
+        if self.future.exception() is not None:
+            self._warn()
+            return
+
+        self.apply()
+        self.image.figure.canvas.draw_idle()
+
+    def applyOnDraw(self):
+        """
+        Wait for the full resolution image whenever the preview is about to be
+        drawn, for canvases that never run timers
+        """
+
+        draw = self.image.draw
+
+        def refinedDraw(renderer,*args,**kwargs):
+            if not self.applied:
+                if self.future.exception() is None:
+                    self.apply()
+                else:
+                    self._warn()
+            return draw(renderer,*args,**kwargs)
+
+        self.image.draw = refinedDraw
+
+        return
+
+    def _warn(self):
+        if not self.applied:
+            # only warn once
+            self.applied = True
+            warnings.warn('fetching the full resolution layer failed, keeping '
+                          'the preview: {0}'.format(self.future.exception()))
+
+
+def _previewSmaller(args,progressive):
+    """
+    Check if a preview of at most `progressive` pixels is smaller than a request
+    """
+
+    size = _requestSize(args)
+    if size:
+        return max(size) > progressive
+
+    dims = args.get('dimensions')
+    if dims is None:
+        # Earth Engine picks the size
+        return True
+
+    return int(dims) > progressive
+
+
+def _refine(image,fetch,viewExtent,localWarp):
+    """
+    Fetch the full resolution image of a preview in the background and set
+    it on the preview's AxesImage when it arrives
+    """
+
+    global _refineExecutor
+    with _refineLock:
+        if _refineExecutor is None:
+            _refineExecutor = ThreadPoolExecutor(max_workers=4)
+
+    ax = image.axes
+    localWarp = localWarp and not warp.isPlateCarree(ax.projection)
+
+    def full():
+        a = fetch()
+        if localWarp:
+            # same extent as the warped preview, only the shape differs
+            with instrument.timer('warp'):
+                a = warp.warpArray(a,viewExtent,ax.projection)[0]
+        return a
+
+    refinement = _Refinement(image,_refineExecutor.submit(full))
+    image._cartoeeRefinement = refinement
+
+    if _runsTimers(ax.figure.canvas):
+        timer = ax.figure.canvas.new_timer(interval=100)
+        timer.add_callback(refinement.poll,timer)
+        timer.start()
+    else:
+        refinement.applyOnDraw()
+
+    return refinement
+
+
+def _runsTimers(canvas):
     """
-    Creates hex color code palette from a matplotlib colormap
+    Check if a canvas belongs to an interactive backend whose event loop runs
+    timers. Agg, the notebook inline backend and file backends never do
+    """
+
+    return getattr(canvas,'required_interactive_framework',None) is not None
+
+
+def refineLayers(ax,timeout=None):
+    """
+    Wait for the full resolution images of progressive layers and draw them
+
+    Interactive backends swap the images in on their own and non-interactive
+    backends such as Agg or the notebook inline backend wait for them when
+    the figure is drawn, this waits for them right away, e.g. before saving
+    from an interactive backend.
 
     Args:
-        cmap (str): string specifying matplotlib colormap to colorize image. If cmap is specified visParams cannot contain 'palette' key
-        n (int, optional): Number of hex color codes to create from colormap. Default is 256
+        ax (matplotlib.axes.Axes | matplotlib.figure.Figure): axes, or figure with all its axes, to refine
+        timeout (float, optional): seconds to wait for each image. Default None waits until done
 
     Returns:
-        palette (list): list of hex color codes from matplotlib colormap for n intervals
+        ax (matplotlib.axes.Axes | matplotlib.figure.Figure): the refined axes or figure
     """
 
-    colormap = cm.get_cmap(cmap, n)
-    vals = np.linspace(0,1,n)
-    palette = list(map(lambda x: colors.rgb2hex(colormap(x)[:3]),vals))
+    axes = ax.axes if isinstance(ax,Figure) else [ax]
 
-    return palette
+    for item in axes:
+        for image in item.images:
+            refinement = getattr(image,'_cartoeeRefinement',None)
+            if refinement is not None:
+                refinement.apply(timeout)
 
+    return ax
 
-def addColorbar(ax,loc=None,visParams=None,discrete=False,**kwargs):
+
+def addLayers(layers,ax,dims=None,region=None,blend='server',cache=None,workers=4,
+              reproject=True):
     """
-    Add a colorbar tp the map based on visualization parameters provided
+    Composite several Earth Engine images into a single layer on a cartopy plot
+
+    With blend='server' every image is visualized and blended by Earth Engine
+    and the stack is fetched as one thumbnail. With blend='client' the layers
+    are fetched in parallel on the same pixel grid and alpha composited once
+    locally. Either way the stack is drawn with a single imshow()
 
     Args:
+        layers (list): layers from bottom to top. Each layer is an ee.image.Image, a (image, visParams, opacity) tuple or a dictionary with 'image' and optional 'visParams', 'opacity' and 'cmap' keys
         ax (cartopy.mpl.geoaxes.GeoAxesSubplot | cartopy.mpl.geoaxes.GeoAxes): required cartopy GeoAxesSubplot object to add image overlay to
-        loc (str, optional): string specifying the position
-        visParams (dict, optional): visualization parameters as a dictionary. See https://developers.google.com/earth-engine/image_visualization for options
-        **kwargs: remaining keyword arguments are passed to colorbar()
+        dims (list | tuple | int | str, optional): dimensions to request earth engine result as [WIDTH,HEIGHT], see addLayer(). With blend='client' the default is 'auto'
+        region (list | tuple, optional): geospatial region of the image to render in format [W,S,E,N]. By default, the bounds of the first layer
+        blend (str, optional): 'server' to blend the layers in Earth Engine or 'client' to blend the fetched layers locally. Default is 'server'
+        cache (cartoee.cache.ThumbCache | bool, optional): on-disk cache for the thumbnails. By default uses the cache set with enableCache() if any, True also enables one if none is set and False disables caching including the in-memory cache of decoded arrays, see setMemoryBudget()
+        workers (int, optional): maximum number of layers to fetch at the same time with blend='client'. Default is 4
+        reproject (bool, optional): see addLayer(). Default is True
 
     Returns:
-        cb (matplotlib.colorbar.ColorbarBase): matplotlib colorbar object
+        ax (cartopy.mpl.geoaxes.GeoAxesSubplot): cartopy GeoAxesSubplot object with Earth Engine results displayed
 
     Raises:
-        Warning: If 'discrete' is true when "palette" key is not in visParams
-        ValueError: If `ax` is not of type cartopy.mpl.geoaxes.GeoAxesSubplot
-        ValueError: If 'cmap' or "palette" key in visParams is not provided
-        ValueError: If "min" in visParams is not of type scalar
-        ValueError: If "max" in visParams is not of type scalar
-        ValueError: If 'loc' or 'cax' keywords are not provided
-        ValueError: If 'loc' is not of type str or does not equal available options
+        ValueError: If `layers` is empty
+        ValueError: If `blend` is not 'server' or 'client'
+        ValueError: If a layer image is not of type ee.image.Image
+        KeyError: If a layer has both a cmap and a "palette" key in its visParams
     """
 
-    if type(ax) not in [GeoAxes,GeoAxesSubplot]:
-        raise ValueError('provided axes not of type cartopy.mpl.geoaxes.GeoAxes '
-                         'or cartopy.mpl.geoaxes.GeoAxesSubplot')
+    _checkAxes(ax)
 
-    if loc:
-        if (type(loc) == str) and (loc in ['left','right','bottom','top']):
-            posOpts = {'left':   [0.01, 0.25, 0.02, 0.5],
-                       'right':  [0.88, 0.25, 0.02, 0.5],
-                       'bottom': [0.25, 0.15, 0.5, 0.02],
-                       'top':    [0.25, 0.88, 0.5, 0.02]}
-
-            cax = ax.figure.add_axes(posOpts[loc])
-
-            if loc == 'left':
-                plt.subplots_adjust(left=0.18)
-            elif loc == 'right':
-                plt.subplots_adjust(right=0.85)
-            else:
-                pass
+    if blend not in ['server','client']:
+        raise ValueError('provided blend must be "server" or "client"')
 
-        else:
-            raise ValueError('provided loc not of type str. options are "left", '
-                             '"top", "right", or "bottom"')
+    specs = [_layerSpec(layer) for layer in layers]
+    if not specs:
+        raise ValueError('provided layers is empty')
 
-    elif 'cax' in kwargs:
-        cax = kwargs['cax']
-        kwargs = {key:kwargs[key] for key in kwargs.keys() if key != 'cax'}
+    if region is None:
+        # the blended image is unbounded, use the footprint of the bottom layer
+        x,y = list(zip(*_imageBounds(specs[0][0])[0]))
+        region = [min(x),min(y),max(x),max(y)]
+
+    if blend == 'server':
+        composite = None
+        for imgObj,visParams,opacity,cmap in specs:
+            layer = _visualize(imgObj,visParams,opacity,cmap)
+            composite = layer if composite is None else composite.blend(layer)
 
+        return addLayer(composite,ax,dims=dims,region=region,cache=cache,reproject=reproject)
+
+    if dims is None:
+        dims = 'auto'
+
+    requests = []
+    for imgObj,visParams,opacity,cmap in specs:
+        args,viewExtent,dims = _layerRequest(ax,imgObj,dims,region,cmap,visParams)
+        if type(dims) not in [list,tuple]:
+            # every layer must come back on the same pixel grid
+            dims = _resolveDims(dims,viewExtent)
+            args['dimensions'] = '{0}x{1}'.format(*dims)
+        serverProj = _serverProjection(ax,args,viewExtent,reproject)
+        requests.append((imgObj,args))
+
+    def fetch(request):
+        return _fetchArray(request[0],request[1],cache)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        arrays = list(pool.map(fetch,requests))
+
+    with instrument.timer('blend'):
+        a = _blendArrays(arrays,[spec[2] for spec in specs])
+
+    _drawLayer(ax,a,viewExtent,reproject,serverProj)
+
+    return ax
+
+
+def _layerSpec(layer):
+    """
+    Normalize a layer given to addLayers() into (image,visParams,opacity,cmap)
+    """
+
+    if isinstance(layer,dict):
+        spec = (layer['image'],layer.get('visParams'),layer.get('opacity'),
+                layer.get('cmap'))
+    elif type(layer) in [list,tuple]:
+        layer = list(layer) + [None]*(3-len(layer))
+        spec = (layer[0],layer[1],layer[2],None)
     else:
-        raise ValueError('loc or cax keywords must be specified')
+        spec = (layer,None,None,None)
 
-    visKeys = list(visParams.keys())
-    if visParams:
-        if 'min' in visParams:
-            vmin = visParams['min']
-            if type(vmin) not in (int,float):
-                raise ValueError('provided min value not of type scalar')
-        else:
-            vmin = 0
+    if type(spec[0]) != ee.image.Image:
+        raise ValueError("provided layer image is not of type ee.image.Image")
 
-        if 'max' in visParams:
-            vmax = visParams['max']
-            if type(vmax) not in (int,float):
-                raise ValueError('provided max value not of type scalar')
-        else:
-            vmax = 1
-
-        if 'opacity' in visParams:
-            alpha = visParams['opacity']
-            if type(alpha) not in (int,float):
-                raise ValueError('provided opacity value of not type scalar')
-        elif 'alpha' in kwargs:
-            alpha = kwargs['alpha']
-        else:
-            alpha = 1
+    visParams = dict(spec[1] or {})
+    if spec[3] and ('palette' in visParams):
+        raise KeyError('cannot provide "palette" in visParams if cmap is specified')
 
-        if 'palette' in visKeys:
-            hexcodes = visParams['palette'].split(',')
-            hexcodes = [i if i[0]=='#' else '#'+i for i in hexcodes]
+    opacity = 1 if spec[2] is None else spec[2]
 
-            if discrete:
-                cmap = mpl.colors.ListedColormap(hexcodes)
-                vals = np.linspace(vmin,vmax,cmap.N+1)
-                norm = mpl.colors.BoundaryNorm(vals, cmap.N)
+    return spec[0],visParams,opacity,spec[3]
 
-            else:
-                cmap = mpl.colors.LinearSegmentedColormap.from_list('custom', hexcodes, N=256)
-                norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
 
-            kwargs['cmap'] = cmap
+def _visualize(imgObj,visParams,opacity,cmap=None):
+    """
+    Get the RGB image Earth Engine renders for a layer of addLayers()
+    """
 
-        elif 'cmap' in kwargs:
-            if discrete:
-                warnings.warn('discrete keyword used when "palette" key is '
-                              'supplied with visParams, creating a continuous '
-                              'colorbar...')
+    visParams = dict(visParams)
+    if cmap:
+        visParams['palette'] = buildPalette(cmap)
+    if type(visParams.get('bands')) == str:
+        visParams['bands'] = [band.strip() for band in visParams['bands'].split(',')]
+    if opacity != 1:
+        visParams['opacity'] = opacity * visParams.get('opacity',1)
 
-            norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
+    return imgObj.visualize(**visParams)
 
-        else:
-            raise ValueError('cmap keyword or "palette" key in visParams must be provided')
 
-    cb = mpl.colorbar.ColorbarBase(cax,norm=norm,alpha=alpha,
-                                    **kwargs)
+def _asRGBA(a):
+    """
+    Get a uint8 (HEIGHT,WIDTH,4) view of a decoded L, RGB or RGBA thumbnail
+    """
 
-    if 'bands' in visKeys:
-        cb.set_label(visParams['bands'])
+    if a.ndim == 2:
+        a = np.repeat(a[:,:,None],3,axis=2)
+    if a.shape[2] == 4:
+        return a
 
-    return cb
+    alpha = np.full(a.shape[:2]+(1,),255,dtype=a.dtype)
+
+    return np.concatenate([a[:,:,:3],alpha],axis=2)
+
+
+def _blendArrays(arrays,opacities):
+    """
+    Alpha composite decoded thumbnails from bottom to top into one uint8 RGBA array
+    """
+
+    height,width = arrays[0].shape[:2]
+
+    rgb = np.zeros((height,width,3),dtype=np.float32)
+    alpha = np.zeros((height,width,1),dtype=np.float32)
+    for a,opacity in zip(arrays,opacities):
+        if a.shape[:2] != (height,width):
+            a = _downscale(a,width,height)
+        a = _asRGBA(a)
+
+        srcAlpha = a[:,:,3:] * np.float32(opacity / 255)
+        # "over" operator on premultiplied colors
+        rgb *= 1 - srcAlpha
+        rgb += a[:,:,:3] * (srcAlpha / 255)
+        alpha *= 1 - srcAlpha
+        alpha += srcAlpha
+
+    with np.errstate(invalid='ignore',divide='ignore'):
+        rgb = np.where(alpha > 0,rgb / alpha,0)
+
+    out = np.empty((height,width,4),dtype=np.uint8)
+    out[:,:,:3] = np.round(rgb * 255)
+    out[:,:,3:] = np.round(alpha * 255)
+
+    return out
+
+
+def fetchLayer(imgObj,dims=None,region=None,cmap=None,visParams=None,cache=None,
+               tiles=None,workers=4,fetchMode='png',outFile=None):
+    """
+    Fetch an Earth Engine image as a reusable layer without drawing it
+
+    The layer keeps the decoded raster with its extent and crs. It can be
+    drawn with addLayer() on any number of axes and projections and saved
+    with Layer.save() to be reloaded later without Earth Engine.
+
+    Args:
+        imgObj (ee.image.Image): Earth Engine image result to fetch
+        dims (list | tuple | int, optional): dimensions to request earth engine result as [WIDTH,HEIGHT], see addLayer(). 'auto' is not supported as there are no axes
+        region (list | tuple, optional): geospatial region of the image to fetch in format [W,S,E,N]. By default, the whole image
+        cmap (str, optional): string specifying matplotlib colormap to colorize image, see addLayer()
+        visParams (dict, optional): visualization parameters as a dictionary, see addLayer()
+        cache (cartoee.cache.ThumbCache | bool, optional): on-disk cache for the thumbnail, see addLayer()
+        tiles (int | list | tuple, optional): fetch the image as a grid of tiles, see addLayer()
+        workers (int, optional): maximum number of tiles to fetch at the same time. Default is 4
+        fetchMode (str, optional): 'png' or 'array', see addLayer(). Default is 'png'
+        outFile (str, optional): path of a .npy file to decode the image into as a memory-mapped array. Saving the layer to the same path does not copy the raster. Default None
+
+    Returns:
+        layer (cartoee.layer.Layer): the fetched layer in EPSG:4326. Unless cache=False its data is shared with the in-memory cache and read-only, copy it to edit it
+
+    Raises:
+        ValueError: If `dims` is 'auto'
+        ValueError: If `imgObj` is not of type ee.image.Image
+        ValueError: If `tiles` is used without `dims`
+        ValueError: If `fetchMode` is not 'png' or 'array'
+    """
+
+    if dims == 'auto':
+        raise ValueError('dims="auto" needs axes, provide the dims to fetch')
+
+    args,viewExtent = _thumbRequest(imgObj,dims,region,cmap,visParams,fetchMode)
+
+    if tiles:
+        a = _fetchTiled(imgObj,args,viewExtent,dims,tiles,workers,cache,outFile)
+    else:
+        a = _fetchArray(imgObj,args,cache,outFile)
+
+    return Layer(a,viewExtent,fetchMode=fetchMode,visParams=visParams,cmap=cmap)
+
+
+def _addStoredLayer(layer,ax,cmap=None,visParams=None,reproject=True):
+    """
+    Draw a fetched layer, restyling 'array' layers with new cmap or visParams
+    """
+
+    a = layer.data
+    style = {}
+    if layer.fetchMode == 'array':
+        if visParams is None:
+            visParams = layer.visParams
+        a,style = _styleArray(a,cmap or layer.cmap,visParams)
+
+    if layer.crs in [None,'EPSG:4326']:
+        serverExtent = None
+    elif layer.crs == warp.serverCrs(ax.projection):
+        serverExtent = layer.extent
+    else:
+        raise ValueError('layer in {0} can only be drawn on axes in the same '
+                         'projection'.format(layer.crs))
+
+    _drawLayer(ax,a,layer.extent,reproject,serverExtent,**style)
+
+    return ax
+
+
+def _checkAxes(ax):
+    """
+    Raise if `ax` is not a cartopy GeoAxes
+    """
+
+    if type(ax) not in [GeoAxes,GeoAxesSubplot]:
+        raise ValueError('provided axes not of type cartopy.mpl.geoaxes.GeoAxes '
+                         'or cartopy.mpl.geoaxes.GeoAxesSubplot')
+
+    return
+
+
+def _thumbRequest(imgObj,dims=None,region=None,cmap=None,visParams=None,fetchMode='png'):
+    """
+    Build the request arguments and the [W,E,S,N] view extent for a layer
+    """
+
+    if type(imgObj) != ee.image.Image:
+        raise ValueError("provided imgObj is not of type ee.image.Image")
+
+    if fetchMode not in ['png','array']:
+        raise ValueError('provided fetchMode must be "png" or "array"')
+
+    if region:
+        mapRegion = _rectangleCoords(region)
+        viewExtent = (region[0],region[2],region[1],region[3])
+    else:
+        mapRegion = _imageBounds(imgObj)
+        x,y = list(zip(*mapRegion[0]))
+        viewExtent = [min(x),max(x),min(y),max(y)]
+
+    if type(dims) == None and type(dims) not in [list,tuple,int]:
+        raise ValueError('provided dims not of type list, tuple, or int')
+
+    args = {'format':'png'}
+    if region:
+        args['region'] = mapRegion
+    if dims:
+        args['dimensions'] = dims
+
+    if visParams:
+        keys = list(visParams.keys())
+        if cmap and ('palette' in keys):
+            raise KeyError('cannot provide "palette" in visParams if cmap is specified')
+
+    if fetchMode == 'array':
+        # visualization is applied locally, only the band selection is requested
+        args['format'] = 'NPY'
+        if visParams and ('bands' in visParams):
+            bands = visParams['bands']
+            if type(bands) == str:
+                bands = [band.strip() for band in bands.split(',')]
+            args['bands'] = bands
+
+    else:
+        if cmap:
+            args['palette'] = ','.join(buildPalette(cmap))
+
+        for key in (visParams or {}):
+            args[key] = visParams[key]
+
+    return args,viewExtent
+
+
+_chunkSize = 64*1024
+
+
+class _PrefixedStream(object):
+    """
+    Readable stream that replays already consumed bytes before the rest of a stream
+    """
+
+    def __init__(self,prefix,stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self,n=-1):
+        if not self.prefix:
+            return self.stream.read(n)
+        if n is None or n < 0:
+            data,self.prefix = self.prefix + self.stream.read(),b''
+            return data
+        data,self.prefix = self.prefix[:n],self.prefix[n:]
+        if len(data) < n:
+            data += self.stream.read(n-len(data))
+        return data
+
+
+def _allocate(shape,dtype,outFile=None):
+    """
+    Allocate an output array, memory-mapped to a .npy file if outFile is given
+    """
+
+    if outFile:
+        return np.lib.format.open_memmap(outFile,mode='w+',dtype=dtype,shape=shape)
+
+    return np.zeros(shape,dtype=dtype)
+
+
+def _layerRequest(ax,imgObj,dims=None,region=None,cmap=None,visParams=None,fetchMode='png'):
+    """
+    Build the request for a layer on `ax`, resolving dims='auto' from the axes
+    """
+
+    args,viewExtent = _thumbRequest(imgObj,None if dims == 'auto' else dims,region,
+                                    cmap,visParams,fetchMode)
+
+    if dims == 'auto':
+        dims = _autoDims(ax,viewExtent)
+        args['dimensions'] = '{0}x{1}'.format(*dims)
+
+    return args,viewExtent,dims
+
+
+def _decodeThumb(data,outFile=None):
+    """
+    Decode a PNG or NPY thumbnail into a writable image array
+
+    `data` can be bytes or a readable stream. PNGs are decoded as the stream
+    is read and kept as uint8. If `outFile` is given the result is written to
+    a memory-mapped .npy file: NPY payloads are copied into it a strip of rows
+    at a time, PNGs are fully decoded by Pillow first and then copied in strips
+    """
+
+    stream = BytesIO(data) if isinstance(data,bytes) else data
+    head = stream.read(_chunkSize)
+
+    if head[:6] == b'\x93NUMPY':
+        return _decodeNpy(_PrefixedStream(head,stream),outFile)
+
+    parser = ImageFile.Parser()
+    chunk = head
+    while chunk:
+        parser.feed(chunk)
+        chunk = stream.read(_chunkSize)
+    img = parser.close()
+
+    if img.mode not in ['RGBA','RGB','L']:
+        img = img.convert('RGBA')
+
+    # copied in strips so the only full size copy is the writable result
+    width,height = img.size
+    bands = len(img.getbands())
+    shape = (height,width) if bands == 1 else (height,width,bands)
+    out = _allocate(shape,np.uint8,outFile)
+    step = max(_chunkSize // (width*bands),1)
+    for y in range(0,height,step):
+        out[y:y+step] = np.asarray(img.crop((0,y,width,min(y+step,height))))
+
+    return out
+
+
+def _readExactly(stream,n):
+    """
+    Read `n` bytes from a stream that can return less than asked for
+    """
+
+    parts = []
+    while n > 0:
+        part = stream.read(n)
+        if not part:
+            raise ValueError('thumbnail ended before all of its data was read')
+        parts.append(part)
+        n -= len(part)
+
+    return b''.join(parts)
+
+
+def _decodeNpy(stream,outFile=None):
+    """
+    Decode an NPY payload with one field per band into a (HEIGHT,WIDTH,BANDS)
+    array, reading it a strip of rows at a time
+    """
+
+    version = np.lib.format.read_magic(stream)
+    if version == (1,0):
+        shape,fortran,dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape,fortran,dtype = np.lib.format.read_array_header_2_0(stream)
+
+    names = dtype.names
+    if names:
+        outDtype = np.result_type(*[dtype.fields[name][0] for name in names])
+        outShape = tuple(shape)+(len(names),)
+    else:
+        outDtype,outShape = dtype,tuple(shape)
+
+    if fortran or len(shape) != 2:
+        a = np.frombuffer(_readExactly(stream,int(np.prod(shape))*dtype.itemsize),dtype)
+        a = a.reshape(shape,order='F' if fortran else 'C')
+        out = _allocate(a.shape+outShape[len(shape):],outDtype,outFile)
+        out[:] = np.stack([a[name] for name in names],axis=-1) if names else a
+        return out
+
+    height,width = shape
+    out = _allocate(outShape,outDtype,outFile)
+    step = max(_chunkSize // max(width*dtype.itemsize,1),1)
+    for y in range(0,height,step):
+        rows = min(step,height-y)
+        strip = np.frombuffer(_readExactly(stream,rows*width*dtype.itemsize),dtype)
+        strip = strip.reshape(rows,width)
+        if names:
+            for i,name in enumerate(names):
+                out[y:y+rows,:,i] = strip[name]
+        else:
+            out[y:y+rows] = strip
+
+    return out
+
+
+def _visParam(visParams,key,default,n):
+    """
+    Get a per band visualization parameter as an array of length n
+    """
+
+    value = visParams.get(key,default)
+    if type(value) == str:
+        value = value.split(',')
+
+    return np.resize(np.array(value,dtype=float),n)
+
+
+def _styleArray(a,cmap=None,visParams=None):
+    """
+    Apply visualization parameters locally to an array of band values
+
+    Single band arrays are returned as they are with the matching colormap and
+    norm for imshow(), multiband arrays are stretched into an RGB image
+    """
+
+    visParams = visParams or {}
+
+    style = {}
+    if 'opacity' in visParams:
+        style['alpha'] = visParams['opacity']
+
+    a = np.ma.masked_invalid(a.astype(float))
+
+    if (a.ndim == 2) or (a.shape[2] == 1):
+        a = a.reshape(a.shape[:2])
+        vmin = _visParam(visParams,'min',a.min(),1)[0]
+        vmax = _visParam(visParams,'max',a.max(),1)[0]
+
+        if 'palette' in visParams:
+            cmap = mpl.colors.LinearSegmentedColormap.from_list(
+                'custom', _paletteHexcodes(visParams['palette']), N=256)
+        elif cmap is None:
+            cmap = 'gray'
+
+        style['cmap'] = cmap
+        style['norm'] = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
+
+        return a,style
+
+    a = a[:,:,:3]
+    vmin = _visParam(visParams,'min',0,3)
+    vmax = _visParam(visParams,'max',1,3)
+    gamma = _visParam(visParams,'gamma',1,3)
+
+    rgb = np.clip((a - vmin) / (vmax - vmin),0,1) ** (1 / gamma)
+
+    return rgb.filled(0),style
+
+
+def _paletteHexcodes(palette):
+    """
+    Get a list of '#' prefixed hex codes from a palette string or list
+    """
+
+    if type(palette) == str:
+        palette = palette.split(',')
+
+    return [i if i[0]=='#' else '#'+i for i in palette]
+
+
+def _colormappedImage(ax):
+    """
+    Get the last image drawn on the axes with a colormap and norm from its
+    band values, if any. Single band PNGs are not, they are already colorized
+    """
+
+    for image in reversed(ax.images):
+        if getattr(image,'_cartoeeColormapped',False):
+            return image
+
+    return None
+
+
+def _serverProjection(ax,args,viewExtent,reproject=True):
+    """
+    Request the image in the axes' projection if Earth Engine knows it
+
+    Sets the 'crs' request argument and returns the extent of the image in
+    the projection, None if the image is requested in lon/lat
+    """
+
+    if not reproject or warp.isPlateCarree(ax.projection):
+        return None
+
+    crs = warp.serverCrs(ax.projection)
+    if crs is None:
+        return None
+
+    args['crs'] = crs
+
+    return warp.projectedExtent(viewExtent,ax.projection)
+
+
+def _drawLayer(ax,a,viewExtent,reproject=False,serverExtent=None,**kwargs):
+    """
+    Display a decoded image array on the axes
+
+    Images already in the axes' projection, or warped into it here, are drawn
+    with the axes' projection as transform so cartopy does not regrid them
+    """
+
+    if serverExtent is not None:
+        a,viewExtent = a,serverExtent
+    elif reproject and not warp.isPlateCarree(ax.projection):
+        with instrument.timer('warp'):
+            a,viewExtent = warp.warpArray(a,viewExtent,ax.projection)
+    else:
+        with instrument.timer('imshow'):
+            image = ax.imshow(a, extent=viewExtent,origin='upper',transform=ccrs.PlateCarree(),
+                              **kwargs)
+        return _tagColormapped(image,kwargs)
+
+    # keep the view as cartopy leaves it when it reprojects the image itself
+    xlim,ylim = ax.get_xlim(),ax.get_ylim()
+    with instrument.timer('imshow'):
+        image = ax.imshow(a, extent=viewExtent,origin='upper',transform=ax.projection,
+                          **kwargs)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+
+    return _tagColormapped(image,kwargs)
+
+
+def _tagColormapped(image,style):
+    """
+    Mark images styled from band values by _styleArray() for addColorbar()
+    """
+
+    image._cartoeeColormapped = 'norm' in style
+
+    return image
+
+
+def _openThumb(imgObj,args,cache=None):
+    """
+    Open a readable stream of the thumbnail for a request, from the cache when
+    possible. Cache misses are streamed into the cache before being read
+    """
+
+    cache = _resolveCache(cache)
+
+    if cache:
+        key = cache.key(imgObj,args)
+        stream = cache.open(key)
+        if stream is not None:
+            instrument.count('cache.hit')
+            return stream
+        instrument.count('cache.miss')
+
+    with instrument.timer('mint'):
+        url = _mintUrl(imgObj,args)
+
+    t0 = time.time()
+    stream = getSession().open(url)
+    if instrument.enabled():
+        stream = instrument.CountingStream(stream,time.time()-t0)
+
+    if cache:
+        with closing(stream):
+            stream = cache.store(key,stream)
+
+    return stream
+
+
+def _requestSize(args):
+    """
+    Get the [WIDTH,HEIGHT] of a request, None if it is not fully specified
+    """
+
+    dims = args.get('dimensions')
+    if type(dims) == str and 'x' in dims:
+        dims = dims.split('x')
+    if type(dims) in [list,tuple] and len(dims) == 2:
+        return int(dims[0]),int(dims[1])
+
+    return None
+
+
+def _downscale(a,width,height):
+    """
+    Downscale an image array to [WIDTH,HEIGHT]
+    """
+
+    if a.dtype == np.uint8 and (a.ndim == 2 or a.shape[2] in [3,4]):
+        return np.asarray(Image.fromarray(a).resize((width,height),Image.BOX))
+
+    rows = ((np.arange(height)+0.5) * a.shape[0] / height).astype(int)
+    cols = ((np.arange(width)+0.5) * a.shape[1] / width).astype(int)
+
+    return a[rows][:,cols]
+
+
+def _fetchArray(imgObj,args,cache=None,outFile=None):
+    """
+    Fetch and decode the image array for a request
+
+    Arrays are kept in the in-memory pyramid unless `cache` is False, a
+    request no larger than an array already fetched for the same layer is
+    downscaled from it. Identical requests made at the same time from several
+    threads share one download
+    """
+
+    if outFile:
+        return _download(imgObj,args,cache,outFile)
+
+    size = _requestSize(args)
+    key = pyramid.key(imgObj,args,exact=size is None)
+    memory = cache is not False
+
+    def lookup():
+        if not memory:
+            return None
+        a = pyramid.get(key,size,_downscale)
+        if a is not None:
+            instrument.count('pyramid.hit')
+        return a
+
+    def fetch():
+        # a call that finished just before this one started may have filled the pyramid
+        a = lookup()
+        if a is None:
+            a = _download(imgObj,args,cache)
+            if memory:
+                pyramid.put(key,a)
+        return a
+
+    a = lookup()
+    if a is not None:
+        return a
+
+    a,shared = inflight.do((key,str(args.get('dimensions'))),fetch)
+    if shared:
+        instrument.count('coalesced')
+
+    return a
+
+
+def _download(imgObj,args,cache=None,outFile=None):
+    """
+    Download and decode the image array for a request
+    """
+
+    with closing(_openThumb(imgObj,args,cache)) as stream:
+        t0 = time.time()
+        a = _decodeThumb(stream,outFile)
+        # reads from the network are reported as transfer time
+        instrument.emit('decode',seconds=time.time()-t0-getattr(stream,'readSeconds',0))
+
+    return a
+
+
+def _mintUrl(imgObj,args):
+    """
+    Get the URL for a request, NPY requests go through the download endpoint
+    """
+
+    if args.get('format') == 'NPY':
+        return imgObj.getDownloadURL(args)
+
+    return imgObj.getThumbUrl(args)
+
+
+def _rectangleCoords(region):
+    """
+    Polygon coordinates of a [W,S,E,N] rectangle as returned by ee.Geometry.Rectangle
+    """
+
+    w,s,e,n = region
+
+    return [[[w,s],[e,s],[e,n],[w,n],[w,s]]]
+
+
+_boundsCache = OrderedDict()
+_boundsLock = threading.Lock()
+_boundsCacheSize = 256
+
+
+def _imageBounds(imgObj):
+    """
+    Bounding polygon coordinates of an image, memoized per image expression so
+    repeated layers of the same image only make one getInfo() call
+    """
+
+    key = imgObj.serialize()
+
+    with _boundsLock:
+        if key in _boundsCache:
+            coords = _boundsCache.pop(key)
+            _boundsCache[key] = coords
+            instrument.count('bounds.hit')
+            return coords
+
+    with instrument.timer('extent'):
+        coords = imgObj.geometry().bounds().getInfo()['coordinates']
+
+    with _boundsLock:
+        _boundsCache[key] = coords
+        while len(_boundsCache) > _boundsCacheSize:
+            _boundsCache.popitem(last=False)
+
+    return coords
+
+
+def _resolveDims(dims,viewExtent):
+    """
+    Get the [WIDTH,HEIGHT] in pixels of a request from the dims argument
+    """
+
+    if dims is None:
+        raise ValueError('dims must be provided when fetching the image as tiles')
+
+    if type(dims) in [list,tuple]:
+        return int(dims[0]),int(dims[1])
+
+    aspect = (viewExtent[1]-viewExtent[0]) / (viewExtent[3]-viewExtent[2])
+    if aspect >= 1:
+        return int(dims),max(int(round(dims/aspect)),1)
+    else:
+        return max(int(round(dims*aspect)),1),int(dims)
+
+
+def _axesPixels(ax):
+    """
+    Get the [WIDTH,HEIGHT] of the axes in pixels at the figure or savefig dpi, whichever is larger
+    """
+
+    fig = ax.figure
+    dpi = fig.dpi
+    savefigDpi = mpl.rcParams['savefig.dpi']
+    if savefigDpi != 'figure':
+        dpi = max(dpi,savefigDpi)
+
+    return ax.get_position().size * fig.get_size_inches() * dpi
+
+
+def _autoDims(ax,viewExtent):
+    """
+    Get the [WIDTH,HEIGHT] in pixels the extent is displayed at on the axes
+    """
+
+    size = _axesPixels(ax)
+
+    if warp.isPlateCarree(ax.projection):
+        extent = viewExtent
+    else:
+        extent = warp.projectedExtent(viewExtent,ax.projection)
+    aspect = (extent[1]-extent[0]) / (extent[3]-extent[2])
+
+    # the extent is fitted into the axes keeping its aspect ratio
+    width = min(size[0],size[1]*aspect)
+    height = width / aspect
+
+    return [max(int(np.ceil(width)),1),max(int(np.ceil(height)),1)]
+
+
+def _tileGrid(args,viewExtent,dims,tiles):
+    """
+    Split a thumbnail request into a grid of sub-rectangle requests
+
+    Returns the full [WIDTH,HEIGHT] and a list of (row,col,args) tile
+    requests where row and col are the pixel offsets of the tile
+    """
+
+    width,height = _resolveDims(dims,viewExtent)
+    if type(tiles) in [list,tuple]:
+        ncols,nrows = tiles
+    else:
+        ncols,nrows = tiles,tiles
+
+    xmin,xmax,ymin,ymax = viewExtent
+    xs = np.linspace(0,width,ncols+1).round().astype(int)
+    ys = np.linspace(0,height,nrows+1).round().astype(int)
+
+    jobs = []
+    for j in range(nrows):
+        for i in range(ncols):
+            w = xs[i+1]-xs[i]
+            h = ys[j+1]-ys[j]
+            if w == 0 or h == 0:
+                continue
+            # rows are counted from the top of the image down
+            tileRegion = [xmin + (xmax-xmin) * xs[i]/width,
+                          ymax - (ymax-ymin) * ys[j+1]/height,
+                          xmin + (xmax-xmin) * xs[i+1]/width,
+                          ymax - (ymax-ymin) * ys[j]/height]
+            tileArgs = dict(args)
+            tileArgs['region'] = _rectangleCoords(tileRegion)
+            tileArgs['dimensions'] = '{0}x{1}'.format(w,h)
+            jobs.append((ys[j],xs[i],tileArgs))
+
+    return (width,height),jobs
+
+
+def _stitchTiles(shape,tiles,outFile=None):
+    """
+    Copy an iterable of (row,col,array) tiles into one preallocated array
+    """
+
+    width,height = shape
+
+    out = None
+    for row,col,tile in tiles:
+        if out is None:
+            out = _allocate((height,width)+tile.shape[2:],tile.dtype,outFile)
+        h = min(tile.shape[0],height-row)
+        w = min(tile.shape[1],width-col)
+        out[row:row+h,col:col+w] = tile[:h,:w]
+
+    return out
+
+
+def _fetchTiled(imgObj,args,viewExtent,dims,tiles,workers=4,cache=None,outFile=None):
+    """
+    Fetch a thumbnail as a grid of sub-rectangles in parallel and stitch the
+    tiles into a single array
+    """
+
+    shape,jobs = _tileGrid(args,viewExtent,dims,tiles)
+
+    def fetch(job):
+        row,col,tileArgs = job
+        return row,col,_fetchArray(imgObj,tileArgs,cache)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        out = _stitchTiles(shape,pool.map(fetch,jobs),outFile)
+
+    return out
+
+
+def _fetchMosaic(imgObj,args,viewExtent,workers=4,cache=None,outFile=None):
+    """
+    Fetch the image of a request as a mosaic of map tiles
+    """
+
+    size = _requestSize(args) or _resolveDims(args['dimensions'],viewExtent)
+    a = maptiles.fetchMosaic(imgObj,maptiles.mapParams(args),viewExtent,size,cache,workers)
+
+    if outFile:
+        out = _allocate(a.shape,a.dtype,outFile)
+        out[:] = a
+        return out
+
+    return a
+
+
+_colorbarCache = OrderedDict()
+_colorbarLock = threading.Lock()
+_colorbarCacheSize = 256
+
+_colorbarPositions = {'left':   [0.01, 0.25, 0.02, 0.5],
+                      'right':  [0.88, 0.25, 0.02, 0.5],
+                      'bottom': [0.25, 0.15, 0.5, 0.02],
+                      'top':    [0.25, 0.88, 0.5, 0.02]}
+
+
+def _colorbarMapping(palette,vmin,vmax,discrete=False):
+    """
+    Get the colormap and norm of a colorbar. Colormaps are memoized per
+    (palette, discrete) so legends repeated across many figures are only
+    built once, every call gets its own copy and a new norm so changing one
+    colorbar does not change the others. The colormap is None if no palette
+    is given
+    """
+
+    discrete = bool(discrete and palette is not None)
+
+    if palette is None:
+        cmap = None
+    else:
+        key = (tuple(_paletteHexcodes(palette)),discrete)
+        with _colorbarLock:
+            cmap = _colorbarCache.pop(key,None)
+            if cmap is not None:
+                _colorbarCache[key] = cmap
+
+        if cmap is None:
+            hexcodes = key[0]
+            if discrete:
+                cmap = mpl.colors.ListedColormap(hexcodes)
+            else:
+                cmap = mpl.colors.LinearSegmentedColormap.from_list('custom', hexcodes, N=256)
+            with _colorbarLock:
+                _colorbarCache[key] = cmap
+                while len(_colorbarCache) > _colorbarCacheSize:
+                    _colorbarCache.popitem(last=False)
+
+        cmap = copy.copy(cmap)
+
+    if discrete:
+        vals = np.linspace(vmin,vmax,cmap.N+1)
+        norm = mpl.colors.BoundaryNorm(vals, cmap.N)
+    else:
+        norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
+
+    return cmap,norm
+
+
+def _colorbarAxes(fig,loc):
+    """
+    Add the axes for a colorbar at one of the predefined positions of a figure
+    """
+
+    if (type(loc) != str) or (loc not in _colorbarPositions):
+        raise ValueError('provided loc not of type str. options are "left", '
+                         '"top", "right", or "bottom"')
+
+    cax = fig.add_axes(_colorbarPositions[loc])
+
+    if loc == 'left':
+        fig.subplots_adjust(left=0.18)
+    elif loc == 'right':
+        fig.subplots_adjust(right=0.85)
+    else:
+        pass
+
+    return cax
+
+
+def addColorbar(ax,loc=None,visParams=None,discrete=False,**kwargs):
+    """
+    Add a colorbar tp the map based on visualization parameters provided
+
+    Args:
+        ax (cartopy.mpl.geoaxes.GeoAxesSubplot | cartopy.mpl.geoaxes.GeoAxes): required cartopy GeoAxesSubplot object to add image overlay to
+        loc (str, optional): string specifying the position
+        visParams (dict, optional): visualization parameters as a dictionary. See https://developers.google.com/earth-engine/image_visualization for options. If no "palette" or cmap is provided the colormap and norm of the last layer fetched with fetchMode='array' are used. Missing "min" and "max" are taken from that layer's range
+        **kwargs: remaining keyword arguments are passed to colorbar()
+
+    Returns:
+        cb (matplotlib.colorbar.ColorbarBase): matplotlib colorbar object
+
+    Raises:
+        Warning: If 'discrete' is true when "palette" key is not in visParams
+        ValueError: If `ax` is not of type cartopy.mpl.geoaxes.GeoAxesSubplot
+        ValueError: If 'cmap' or "palette" key in visParams is not provided and `ax` has no layer fetched with fetchMode='array'
+        ValueError: If "min" in visParams is not of type scalar
+        ValueError: If "max" in visParams is not of type scalar
+        ValueError: If 'loc' or 'cax' keywords are not provided
+        ValueError: If 'loc' is not of type str or does not equal available options
+    """
+
+    if type(ax) not in [GeoAxes,GeoAxesSubplot]:
+        raise ValueError('provided axes not of type cartopy.mpl.geoaxes.GeoAxes '
+                         'or cartopy.mpl.geoaxes.GeoAxesSubplot')
+
+    if loc:
+        cax = _colorbarAxes(ax.figure,loc)
+
+    elif 'cax' in kwargs:
+        cax = kwargs['cax']
+        kwargs = {key:kwargs[key] for key in kwargs.keys() if key != 'cax'}
+
+    else:
+        raise ValueError('loc or cax keywords must be specified')
+
+    return _drawColorbar(cax,visParams,discrete,ax,**kwargs)
+
+
+def _drawColorbar(cax,visParams=None,discrete=False,ax=None,**kwargs):
+    """
+    Draw a colorbar from visualization parameters on `cax`
+    """
+
+    if visParams is None:
+        visParams = {}
+
+    image = None if ax is None else _colormappedImage(ax)
+    if image is not None and not ('min' in visParams and 'max' in visParams):
+        # layers fetched as arrays without "min"/"max" are scaled to their values
+        visParams = dict(visParams)
+        visParams.setdefault('min',float(image.norm.vmin))
+        visParams.setdefault('max',float(image.norm.vmax))
+
+    visKeys = list(visParams.keys())
+    if 'min' in visParams:
+        vmin = visParams['min']
+        if type(vmin) not in (int,float):
+            raise ValueError('provided min value not of type scalar')
+    else:
+        vmin = 0
+
+    if 'max' in visParams:
+        vmax = visParams['max']
+        if type(vmax) not in (int,float):
+            raise ValueError('provided max value not of type scalar')
+    else:
+        vmax = 1
+
+    if 'opacity' in visParams:
+        alpha = visParams['opacity']
+        if type(alpha) not in (int,float):
+            raise ValueError('provided opacity value of not type scalar')
+    elif 'alpha' in kwargs:
+        alpha = kwargs.pop('alpha')
+    else:
+        alpha = 1
+
+    if 'palette' in visKeys:
+        kwargs['cmap'],norm = _colorbarMapping(visParams['palette'],vmin,vmax,discrete)
+
+    elif 'cmap' in kwargs:
+        if discrete:
+            warnings.warn('discrete keyword used when "palette" key is '
+                          'supplied with visParams, creating a continuous '
+                          'colorbar...')
+
+        norm = _colorbarMapping(None,vmin,vmax)[1]
+
+    elif image is not None:
+        # layers fetched as arrays already carry their colormap and norm
+        kwargs['cmap'] = image.get_cmap()
+        norm = image.norm
+
+    else:
+        raise ValueError('cmap keyword or "palette" key in visParams must be provided')
+
+    cb = mpl.colorbar.ColorbarBase(cax,norm=norm,alpha=alpha,
+                                    **kwargs)
+
+    if 'bands' in visKeys:
+        cb.set_label(visParams['bands'])
+
+    return cb
+
+
+class ColorbarTemplate(object):
+    """
+    Colorbar rendered once to an image and stamped onto many figures
+
+    Building a colorbar lays out its ticks and labels every time, stamping a
+    template only draws one small image. The template is rendered for a
+    figure of `figsize` and `dpi` and looks the same on figures of that size.
+
+    Args:
+        loc (str): string specifying the position, "left", "top", "right", or "bottom"
+        visParams (dict, optional): visualization parameters as a dictionary, see addColorbar()
+        discrete (bool, optional): draw a discrete colorbar for "palette" visParams, see addColorbar()
+        figsize (list | tuple, optional): size in inches of the figures the template is stamped on. Default is the matplotlib default figure size
+        dpi (float, optional): resolution of the figures the template is stamped on. Default is the matplotlib default figure dpi
+        **kwargs: remaining keyword arguments are passed to colorbar()
+
+    Raises:
+        ValueError: If 'loc' is not of type str or does not equal available options
+    """
+
+    def __init__(self,loc,visParams=None,discrete=False,figsize=None,dpi=None,**kwargs):
+        self.loc = loc
+
+        fig = Figure(figsize=figsize,dpi=dpi)
+        fig.patch.set_alpha(0)
+        canvas = FigureCanvasAgg(fig)
+        cax = _colorbarAxes(fig,loc)
+        _drawColorbar(cax,visParams,discrete,**kwargs)
+        canvas.draw()
+
+        # crop to the colorbar with its ticks and labels
+        bbox = cax.get_tightbbox(canvas.get_renderer())
+        width,height = canvas.get_width_height()
+        x0,x1 = max(int(np.floor(bbox.x0)),0),min(int(np.ceil(bbox.x1)),width)
+        y0,y1 = max(int(np.floor(bbox.y0)),0),min(int(np.ceil(bbox.y1)),height)
+
+        rgba = np.asarray(canvas.buffer_rgba())
+        # image rows count down from the top of the figure
+        self.image = rgba[height-y1:height-y0,x0:x1].copy()
+        self.position = [x0/width,y0/height,(x1-x0)/width,(y1-y0)/height]
+
+    def stamp(self,ax):
+        """
+        Add the colorbar image to the figure of `ax`
+
+        Args:
+            ax (matplotlib.axes.Axes): axes of the figure to add the colorbar to
+
+        Returns:
+            cax (matplotlib.axes.Axes): axes the colorbar image is drawn on
+        """
+
+        fig = ax.figure
+        if self.loc == 'left':
+            fig.subplots_adjust(left=0.18)
+        elif self.loc == 'right':
+            fig.subplots_adjust(right=0.85)
+
+        cax = fig.add_axes(self.position)
+        cax.imshow(self.image,aspect='auto',interpolation='nearest')
+        cax.set_axis_off()
+
+        return cax
 
 
 if __name__ == "__main__":
@@ -0,0 +1,423 @@
+from __future__ import print_function, division
+
+import io
+import sys
+import socket
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs, urlencode
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from urllib import urlencode
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+
+import ee
+import cartopy.crs as ccrs
+import cartoee as cee
+from cartoee import cache, features, maptiles, palette, plotting, warp
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeEarthEngine(object):
+    """
+    Local HTTP server standing in for the Earth Engine thumbnail, download and
+    map tile endpoints. It returns synthetic PNG or NPY images of the
+    requested size after `latency` seconds. Statuses appended to `errors`
+    are answered to the next requests instead, one each
+    """
+
+    def __init__(self,latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.errors = []
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                width = int(query['w'][0])
+                height = int(query['h'][0])
+                data = server.payload(width,height,query['f'][0])
+
+                with server._lock:
+                    server.requests += 1
+                    status = server.errors.pop(0) if server.errors else 200
+                time.sleep(server.latency)
+
+                if status != 200:
+                    self.send_response(status)
+                    self.send_header('Content-Length','0')
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Length',str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except socket.error:
+                    # the client timed out and closed the connection
+                    pass
+
+            def log_message(self,*args):
+                pass
+
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1',0),Handler)
+        self.url = 'http://127.0.0.1:{0}/'.format(self.httpd.server_address[1])
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def payload(self,width,height,fmt):
+        key = (width,height,fmt)
+        with self._lock:
+            if key in self._payloads:
+                return self._payloads[key]
+
+        x = np.linspace(0,1,width)[None,:]
+        y = np.linspace(0,1,height)[:,None]
+        value = np.sin(8*np.pi*x) * np.cos(6*np.pi*y)
+
+        buf = io.BytesIO()
+        if fmt == 'NPY':
+            a = np.zeros((height,width),dtype=[('b1','<f4')])
+            a['b1'] = value
+            np.save(buf,a)
+        else:
+            a = np.zeros((height,width,4),dtype=np.uint8)
+            a[:,:,0] = ((value+1)*127.5).astype(np.uint8)
+            a[:,:,1] = (y*255).astype(np.uint8)
+            a[:,:,2] = (x*255).astype(np.uint8)
+            a[:,:,3] = 255
+            Image.fromarray(a).save(buf,format='PNG')
+
+        data = buf.getvalue()
+        with self._lock:
+            self._payloads[key] = data
+
+        return data
+
+    def image(self,name='synthetic',bounds=(-180,-60,180,90)):
+        """
+        Create an ee.Image whose requests are served by this server
+
+        Args:
+            name (str, optional): name used for the serialized expression, images with the same name share cache entries
+            bounds (list | tuple, optional): [W,S,E,N] footprint of the image
+
+        Returns:
+            img (ee.image.Image): image usable with addLayer() without an ee session
+        """
+
+        server = self
+        w,s,e,n = bounds
+
+        def url(args,fmt):
+            dims = args.get('dimensions',256)
+            if type(dims) == str:
+                width,height = [int(v) for v in dims.split('x')]
+            elif type(dims) in [list,tuple]:
+                width,height = int(dims[0]),int(dims[1])
+            else:
+                width,height = int(dims),max(int(dims)//2,1)
+            return server.url + '?' + urlencode({'w':width,'h':height,'f':fmt})
+
+        class Bounds(object):
+            def bounds(self):
+                return self
+
+            def getInfo(self):
+                return {'type':'Polygon',
+                        'coordinates':[[[w,s],[e,s],[e,n],[w,n],[w,s]]]}
+
+        class TileFetcher(object):
+            def format_tile_url(self,x,y,z):
+                return server.url + '?' + urlencode({'w':256,'h':256,'f':'png',
+                                                     'z':z,'x':x,'y':y})
+
+        # addLayer checks for exactly ee.Image so the instance is patched
+        # instead of subclassed, which also avoids needing ee.Initialize()
+        img = ee.image.Image.__new__(ee.image.Image)
+        img.getThumbUrl = lambda args: url(args,'png')
+        img.getDownloadURL = lambda args: url(args,'NPY')
+        img.getMapId = lambda visParams=None: {'tile_fetcher':TileFetcher()}
+        img.serialize = lambda *args,**kwargs: json.dumps({'synthetic':name})
+        img.geometry = lambda *args,**kwargs: Bounds()
+
+        return img
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# name of the case used to scale baseline timings to the current machine
+_calibration = 'calibration'
+
+
+def _resetCaches():
+    cache.pyramid.clear()
+    plotting._boundsCache.clear()
+    palette._paletteCache.clear()
+    plotting._colorbarCache.clear()
+    warp._indexCache.clear()
+    features._featureCache.clear()
+    maptiles._tileCache.clear()
+
+
+def _measure(name,func,repeat,cold=True):
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        if cold:
+            _resetCaches()
+        if tracemalloc:
+            tracemalloc.start()
+        t0 = time.time()
+        func()
+        times.append(time.time()-t0)
+        if tracemalloc:
+            peak = max(peak,tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        plt.close('all')
+
+    times = np.array(times)
+    return {'name':name,
+            'repeat':repeat,
+            'mean':float(times.mean()),
+            'p50':float(np.percentile(times,50)),
+            'p90':float(np.percentile(times,90)),
+            'throughput':float(repeat/times.sum()),
+            'peakMB':peak/1024**2}
+
+
+def _savefig():
+    buf = io.BytesIO()
+    plt.savefig(buf,format='png')
+
+
+def cases(server,quick=False):
+    """
+    Build the list of (name,function,cold) benchmark cases
+    """
+
+    img = server.image()
+    vis = {'min':-1,'max':1}
+    sizes = [256,1024] if quick else [256,1024,2048]
+
+    def layer(dims,**kwargs):
+        # cache=None only uses the in-memory cache, no thumbnail cache is enabled
+        kwargs.setdefault('cache',False)
+        def run():
+            ax = plt.axes(projection=ccrs.PlateCarree())
+            cee.addLayer(img,ax,dims=dims,visParams=vis,**kwargs)
+        return run
+
+    def getMap(proj,dims):
+        def run():
+            cee.getMap(img,proj=proj,dims=dims,visParams=vis,cmap='viridis',cache=False)
+            _savefig()
+        return run
+
+    def layers(n,dims):
+        def run():
+            ax = plt.axes(projection=ccrs.PlateCarree())
+            for i in range(n):
+                cee.addLayer(server.image('layer{0}'.format(i)),ax,dims=dims,
+                             visParams=vis,cache=False)
+            _savefig()
+        return run
+
+    def composite(n,dims):
+        def run():
+            ax = plt.axes(projection=ccrs.PlateCarree())
+            cee.addLayers([(server.image('layer{0}'.format(i)),vis,0.5) for i in range(n)],
+                          ax,dims=dims,blend='client',cache=False)
+            _savefig()
+        return run
+
+    def concurrent(n,dims):
+        def run():
+            def render(i):
+                # pyplot is not thread safe, each thread draws on its own figure
+                fig = Figure()
+                FigureCanvasAgg(fig)
+                ax = fig.add_subplot(projection=ccrs.PlateCarree())
+                cee.addLayer(img,ax,dims=dims,visParams=vis,cache=False)
+            with ThreadPoolExecutor(max_workers=n) as pool:
+                list(pool.map(render,range(n)))
+        return run
+
+    def colorbar():
+        ax = plt.axes(projection=ccrs.PlateCarree())
+        cee.addColorbar(ax,loc='right',cmap='viridis',visParams=vis)
+        _savefig()
+
+    template = cee.ColorbarTemplate('right',cmap='viridis',visParams=vis)
+
+    def stamp():
+        ax = plt.axes(projection=ccrs.PlateCarree())
+        template.stamp(ax)
+        _savefig()
+
+    png = server.payload(1024,512,'png')
+
+    def calibration():
+        # matplotlib and PIL work that does not go through cartoee, it times
+        # the machine so results can be compared with a baseline from another
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        ax.imshow(np.asarray(Image.open(io.BytesIO(png))))
+        fig.savefig(io.BytesIO(),format='png')
+
+    out = [(_calibration,calibration,True)]
+    for n in [256,4096]:
+        out.append(('buildPalette n={0}'.format(n),
+                    lambda n=n: cee.buildPalette('viridis',n),True))
+        out.append(('buildPalette n={0} memoized'.format(n),
+                    lambda n=n: cee.buildPalette('viridis',n),False))
+
+    for size in sizes:
+        out.append(('addLayer png {0}px'.format(size),layer([size,size//2],cache=None),True))
+        out.append(('addLayer png {0}px pyramid'.format(size),layer([size//2,size//4],cache=None),
+                    False))
+    out.append(('addLayer array {0}px'.format(sizes[-1]),
+                layer([sizes[-1],sizes[-1]//2],fetchMode='array'),True))
+    out.append(('addLayer png {0}px tiles=2'.format(sizes[-1]),
+                layer([sizes[-1],sizes[-1]//2],tiles=2),True))
+
+    for proj in [ccrs.PlateCarree(),ccrs.Mollweide(),ccrs.Orthographic(-5,33)]:
+        label = 'getMap {0} 1024px'.format(type(proj).__name__)
+        out.append((label,getMap(proj,[1024,512]),True))
+        out.append((label+' warm',getMap(proj,[1024,512]),False))
+
+    for n in [1,3] if quick else [1,3,6]:
+        out.append(('{0} layers 512px'.format(n),layers(n,[512,256]),True))
+        out.append(('{0} layers 512px composite'.format(n),composite(n,[512,256]),True))
+
+    out.append(('8 threads same layer 1024px',concurrent(8,[1024,512]),True))
+    out.append(('addColorbar',colorbar,True))
+    out.append(('addColorbar warm',colorbar,False))
+    out.append(('ColorbarTemplate stamp',stamp,False))
+
+    return out
+
+
+def run(latency=0.0,repeat=5,quick=False):
+    """
+    Run all benchmark cases against a local fake Earth Engine server
+
+    Args:
+        latency (float, optional): seconds the fake server waits before each response. Default is 0
+        repeat (int, optional): number of times each case is run. Default is 5
+        quick (bool, optional): run fewer and smaller cases. Default is False
+
+    Returns:
+        results (list): one dictionary per case with 'mean', 'p50' and 'p90' seconds, 'throughput' per second and 'peakMB' traced memory
+    """
+
+    server = FakeEarthEngine(latency=latency)
+    try:
+        results = [_measure(name,func,repeat,cold)
+                   for name,func,cold in cases(server,quick)]
+    finally:
+        server.close()
+
+    return results
+
+
+def compare(results,baseline,tolerance=1.5,minSeconds=0.005):
+    """
+    Get the cases whose mean time is more than `tolerance` times the baseline
+    and at least `minSeconds` slower, so timer noise on sub-millisecond cases
+    is not reported. When both contain the calibration case the baseline is
+    first scaled by how much slower this machine runs it, so a baseline
+    recorded on one machine can gate runs on another
+    """
+
+    reference = dict((item['name'],item['mean']) for item in baseline)
+
+    # the median leaves out the first run, which also loads fonts and backends
+    calibration = [[item['p50'] for item in items if item['name'] == _calibration]
+                   for items in [results,baseline]]
+    scale = 1.0
+    if all(calibration):
+        scale = calibration[0][0] / calibration[1][0]
+    reference = dict((name,mean*scale) for name,mean in reference.items())
+
+    return [item['name'] for item in results
+            if item['name'] in reference and item['name'] != _calibration
+            and item['mean'] > tolerance * reference[item['name']]
+            and item['mean'] - reference[item['name']] > minSeconds * scale]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline cartoee benchmarks')
+    parser.add_argument('--latency',type=float,default=0.0,
+                        help='seconds the fake server waits before each response')
+    parser.add_argument('--repeat',type=int,default=5,
+                        help='number of times each case is run')
+    parser.add_argument('--quick',action='store_true',
+                        help='run fewer and smaller cases')
+    parser.add_argument('--json',help='write the results to this file')
+    parser.add_argument('--baseline',help='results file to check for regressions against')
+    parser.add_argument('--tolerance',type=float,default=1.5,
+                        help='allowed slowdown relative to the baseline, after scaling it '
+                             'by the calibration case')
+    args = parser.parse_args(argv)
+
+    results = run(latency=args.latency,repeat=args.repeat,quick=args.quick)
+
+    print('{0:<40} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+          'case','mean ms','p50 ms','p90 ms','ops/s','peak MB'))
+    for item in results:
+        print('{0:<40} {1:>10.2f} {2:>10.2f} {3:>10.2f} {4:>10.1f} {5:>10.1f}'.format(
+              item['name'],item['mean']*1e3,item['p50']*1e3,item['p90']*1e3,
+              item['throughput'],item['peakMB']))
+
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump(results,f,indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(results,json.load(f),args.tolerance)
+        if slower:
+            print('\nRegressions: {0}'.format(', '.join(slower)))
+            sys.exit(1)
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
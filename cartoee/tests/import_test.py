@@ -0,0 +1,78 @@
+from __future__ import print_function
+import sys
+import json
+import argparse
+import subprocess
+
+# modules that must not be loaded until they are used
+heavyModules = ['ee','matplotlib.pyplot','cartopy.crs','cartopy.mpl.geoaxes']
+
+# seconds, measured in a fresh interpreter
+budgets = {'import cartoee': 0.1,
+           'cartoee.buildPalette': 1.0}
+
+_script = '''
+import sys, time, json
+t0 = time.time()
+import cartoee
+t1 = time.time()
+cartoee.buildPalette('viridis')
+t2 = time.time()
+print(json.dumps({'import cartoee': t1-t0,
+                  'cartoee.buildPalette': t2-t1,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def measure(repeat=3):
+    """
+    Measure the import times in fresh interpreters, keeping the fastest run
+
+    Returns:
+        times (dict): seconds per budget entry and the heavy modules that were loaded
+    """
+
+    best = None
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable,'-c',_script % heavyModules])
+        result = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+        if best is None:
+            best = result
+        else:
+            for key in budgets:
+                best[key] = min(best[key],result[key])
+
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check cartoee import times')
+    parser.add_argument('--repeat',type=int,default=3,
+                        help='number of fresh interpreters to measure')
+    parser.add_argument('--scale',type=float,default=1.0,
+                        help='multiply the budgets, e.g. for slow machines')
+    args = parser.parse_args(argv)
+
+    result = measure(args.repeat)
+
+    failed = []
+    for key,budget in sorted(budgets.items()):
+        seconds = result[key]
+        ok = seconds <= budget * args.scale
+        print('{0:<25} {1:>8.1f} ms  budget {2:>8.1f} ms  {3}'.format(
+              key,seconds*1e3,budget*args.scale*1e3,'ok' if ok else 'over budget'))
+        if not ok:
+            failed.append(key)
+
+    if result['loaded']:
+        print('heavy modules loaded without use: {0}'.format(', '.join(result['loaded'])))
+        failed.append('loaded')
+
+    if failed:
+        sys.exit(1)
+
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,979 @@
+from __future__ import print_function, division
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import traceback
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy as np
+import requests
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.path import Path
+
+import ee
+import cartopy.crs as ccrs
+import cartoee as cee
+from cartoee import cache, cli, plotting
+from cartoee.tests.benchmark import FakeEarthEngine, _resetCaches, compare
+
+# behaviour checks against the local fake Earth Engine server, they run
+# without an Earth Engine account. Run with `python -m cartoee.tests.offline_test`
+# or pytest
+
+_server = None
+
+
+def _fake():
+    """
+    Get the shared fake server with its request count reset and empty caches
+    """
+
+    global _server
+    if _server is None:
+        _server = FakeEarthEngine()
+
+    _resetCaches()
+    _server.requests = 0
+    _server.errors = []
+
+    return _server
+
+
+def _axes(proj=ccrs.PlateCarree()):
+    return plt.axes(projection=proj)
+
+
+def testCacheFalseSkipsMemoryCache():
+    server = _fake()
+    img = server.image()
+
+    for _ in range(3):
+        cee.addLayer(img,_axes(),dims=[20,10],cache=False)
+
+    assert server.requests == 3, server.requests
+
+
+def testMemoryCacheServesSmallerRequests():
+    server = _fake()
+    img = server.image()
+
+    cee.addLayer(img,_axes(),dims=[40,20])
+    ax = cee.addLayer(img,_axes(),dims=[20,10])
+
+    assert server.requests == 1, server.requests
+    assert ax.images[-1].get_array().shape[:2] == (10,20)
+
+
+def testDefaultSizeIsNotServedFromMemoryCache():
+    server = _fake()
+    img = server.image()
+
+    cee.addLayer(img,_axes(),dims=[20,10],cache=False)
+    cee.addLayer(img,_axes(),dims=[20,10])
+    ax = cee.addLayer(img,_axes())
+
+    assert server.requests == 3, server.requests
+    assert ax.images[-1].get_array().shape[:2] == (128,256)
+
+
+def testMemoryCacheExpires():
+    server = _fake()
+    img = server.image()
+
+    ttl = cache.pyramid.ttl
+    cache.setMemoryBudget(cache.pyramid.maxBytes,ttl=-1)
+    try:
+        cee.addLayer(img,_axes(),dims=[20,10])
+        cee.addLayer(img,_axes(),dims=[20,10])
+    finally:
+        cache.setMemoryBudget(cache.pyramid.maxBytes,ttl=ttl)
+
+    assert server.requests == 2, server.requests
+
+
+def _age(thumbs,key,accessed=None,created=None):
+    """
+    Move the access and creation times of a cache entry back by some seconds
+    """
+
+    path = thumbs._path(key)
+    st = os.stat(path)
+    os.utime(path,(st.st_atime-(accessed or 0),st.st_mtime-(created or 0)))
+
+
+def testThumbCacheEvictsLeastRecentlyUsed():
+    directory = tempfile.mkdtemp()
+    try:
+        thumbs = cache.ThumbCache(directory,maxSize=250)
+        thumbs.put('a',b'a'*100)
+        thumbs.put('b',b'b'*100)
+        _age(thumbs,'a',accessed=20)
+        _age(thumbs,'b',accessed=10)
+        assert thumbs.get('a') == b'a'*100
+
+        scans = []
+        entries = thumbs._entries
+        thumbs._entries = lambda: scans.append(1) or entries()
+        thumbs.put('c',b'c'*40)
+        # under the limit the directory is not listed again
+        assert scans == []
+        thumbs.put('d',b'd'*40)
+        assert scans == [1]
+
+        assert thumbs.get('b') is None
+        assert [thumbs.get(key) is not None for key in 'acd'] == [True]*3
+        assert thumbs._size == 180, thumbs._size
+    finally:
+        shutil.rmtree(directory)
+
+
+def testThumbCacheEntriesExpire():
+    directory = tempfile.mkdtemp()
+    try:
+        thumbs = cache.ThumbCache(directory,ttl=60)
+        thumbs.put('old',b'x'*10)
+        thumbs.put('new',b'y'*10)
+        _age(thumbs,'old',created=120)
+
+        assert thumbs.get('old') is None
+        assert not os.path.exists(thumbs._path('old'))
+        assert thumbs.get('new') == b'y'*10
+        assert thumbs._size == 10, thumbs._size
+    finally:
+        shutil.rmtree(directory)
+
+
+def testThumbCacheInvalidate():
+    directory = tempfile.mkdtemp()
+    try:
+        thumbs = cache.ThumbCache(directory)
+        thumbs.put('a',b'a'*10)
+        thumbs.put('a',b'a'*30)
+        assert thumbs._size == 30, thumbs._size
+
+        thumbs.invalidate('a')
+        thumbs.invalidate('missing')
+
+        assert thumbs.get('a') is None
+        assert thumbs._size == 0, thumbs._size
+    finally:
+        shutil.rmtree(directory)
+
+
+def testCacheTrueEnablesDefaultCache():
+    server = _fake()
+    img = server.image()
+
+    directory = tempfile.mkdtemp()
+    home = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = directory
+    try:
+        cee.addLayer(img,_axes(),dims=[20,10],cache=True)
+        assert cache.getCache().directory.startswith(directory)
+        cache.pyramid.clear()
+        cee.addLayer(img,_axes(),dims=[20,10],cache=True)
+    finally:
+        cache.disableCache()
+        if home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = home
+        shutil.rmtree(directory)
+
+    # the second layer is read from the disk cache
+    assert server.requests == 1, server.requests
+
+
+def testBatchReportsWorkerInitErrors():
+    directory = tempfile.mkdtemp()
+    try:
+        results = cee.renderBatch([{'image':'a'},{'image':'b'}],workers=2,out_dir=directory,
+                                  initKwargs={'notAnArgument':True})
+    finally:
+        shutil.rmtree(directory)
+
+    assert [r['index'] for r in results] == [0,1]
+    for result in results:
+        assert 'notAnArgument' in result['error'], result['error']
+
+
+def testBatchRendersPngAndPdf():
+    server = _fake()
+
+    colorbar = {'loc':'bottom','cmap':'gist_earth','orientation':'horizontal'}
+    jobs = [{'image':'srtm','region':[-20,-40,60,40],'dims':[64,32],'cmap':'gist_earth',
+             'filename':'srtm.png'},
+            {'image':'srtm','region':[-20,-40,60,40],'dims':[64,32],'cmap':'gist_earth',
+             'proj':ccrs.Mollweide(),'colorbar':colorbar,'filename':'srtm.pdf'}]
+
+    directory = tempfile.mkdtemp()
+    # asset ids are resolved with ee.Image(), workers=1 renders in this process
+    image = ee.Image
+    ee.Image = server.image
+    try:
+        results = cee.renderBatch(jobs,workers=1,out_dir=directory)
+        for result in results:
+            assert result['error'] is None, result['error']
+
+        with open(os.path.join(directory,'srtm.png'),'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+        with open(os.path.join(directory,'srtm.pdf'),'rb') as f:
+            assert f.read(5) == b'%PDF-'
+    finally:
+        ee.Image = image
+        shutil.rmtree(directory)
+
+    assert [r['index'] for r in results] == [0,1]
+    # the second job is the same image and region, served from the memory cache
+    assert server.requests == 1, server.requests
+
+
+def _recordRequests(img):
+    """
+    Record the thumbnail request arguments of a fake image
+    """
+
+    requests = []
+    getThumbUrl = img.getThumbUrl
+    img.getThumbUrl = lambda args: requests.append(dict(args)) or getThumbUrl(args)
+
+    return requests
+
+
+def testClientBlendDrawsOneImage():
+    server = _fake()
+    bottom,top = server.image('bottom'),server.image('top')
+    requests = [_recordRequests(bottom),_recordRequests(top)]
+    layers = [bottom,{'image':top,'cmap':'gist_earth','opacity':0.6}]
+
+    ax = cee.addLayers(layers,_axes(),dims=[64,32],region=[-20,-40,60,40],blend='client',
+                       cache=False)
+
+    # the cmap of a layer without visParams is requested as its palette
+    assert 'palette' not in requests[0][0]
+    assert requests[1][0]['palette'] == ','.join(cee.buildPalette('gist_earth'))
+    assert len(ax.images) == 1
+    a = ax.images[0].get_array()
+    assert a.shape == (32,64,4), a.shape
+    # an opaque layer under a translucent one stays opaque
+    assert (a[:,:,3] == 255).all()
+    assert server.requests == 2, server.requests
+
+
+def testAnimationWritesEveryFrame():
+    from PIL import Image
+
+    server = _fake()
+    frames = [server.image('frame{0}'.format(i)) for i in range(3)]
+
+    directory = tempfile.mkdtemp()
+    try:
+        outFile = cee.animateCollection(frames,os.path.join(directory,'frames.gif'),
+                                        dims=[64,32],region=[-20,-40,60,40],cmap='gist_earth',
+                                        labels=['a','b','c'],colorbar={'loc':'right'},
+                                        fetchMode='array',cache=False)
+        image = Image.open(outFile)
+        nFrames = image.n_frames
+        image.close()
+    finally:
+        shutil.rmtree(directory)
+
+    assert nFrames == 3, nFrames
+    assert server.requests == 3, server.requests
+
+
+def testRenderMapFromThreads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    server = _fake()
+    img = server.image()
+
+    def render(proj):
+        return cee.renderMap(img,proj=proj,region=[-20,-40,60,40],dims=[64,32],
+                             visParams={'min':-1,'max':1},cmap='gist_earth',colorbar='bottom',
+                             fetchMode='array',cache=False)
+
+    figures = plt.get_fignums()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        images = list(pool.map(render,[ccrs.PlateCarree(),ccrs.Mollweide()]*2))
+
+    for image in images:
+        assert image[:8] == b'\x89PNG\r\n\x1a\n'
+    assert images[0] == images[2]
+    assert images[1] == images[3]
+    assert images[0] != images[1]
+    # maps are never registered with pyplot
+    assert plt.get_fignums() == figures
+
+
+def testSavedLayerIsDrawnWithoutRequests():
+    server = _fake()
+    img = server.image()
+
+    layer = cee.fetchLayer(img,region=[-20,-40,60,40],dims=[64,32],visParams={'min':-1,'max':1},
+                           cmap='gist_earth',fetchMode='array',cache=False)
+    assert layer.shape[:2] == (32,64), layer.shape
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = layer.save(os.path.join(directory,'layer'))
+        loaded = cee.Layer.load(path)
+
+        assert isinstance(loaded.data,np.memmap)
+        assert (np.asarray(loaded.data) == np.asarray(layer.data)).all()
+        assert loaded.extent == layer.extent
+        assert (loaded.visParams,loaded.cmap) == (layer.visParams,'gist_earth')
+
+        for proj in [ccrs.PlateCarree(),ccrs.Mollweide()]:
+            ax = cee.addLayer(loaded,_axes(proj))
+            assert len(ax.images) == 1
+        del loaded,ax
+        plt.close('all')
+    finally:
+        shutil.rmtree(directory)
+
+    assert server.requests == 1, server.requests
+
+
+def testCachedLayerDataIsReadOnly():
+    server = _fake()
+    img = server.image()
+
+    layer = cee.fetchLayer(img,region=[-20,-40,60,40],dims=[64,32],fetchMode='array')
+    data = np.array(layer.data)
+    try:
+        layer.data[...] = 7
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('cached layer data is writable')
+
+    ax = cee.addLayer(img,_axes(),region=[-20,-40,60,40],dims=[64,32],fetchMode='array')
+    assert (ax.images[-1].get_array() == data[:,:,0]).all()
+    assert server.requests == 1, server.requests
+
+    # without the in-memory cache the layer owns its data
+    layer = cee.fetchLayer(img,region=[-20,-40,60,40],dims=[64,32],fetchMode='array',cache=False)
+    layer.data[...] = 7
+
+
+def testMapGridSharesOneRange():
+    server = _fake()
+    images = [server.image('panel{0}'.format(i)) for i in range(5)]
+
+    fig,axes = cee.getMapGrid(images,ncols=3,region=[-20,-40,60,40],dims=[64,32],
+                              cmap='gist_earth',colorbar='bottom',fetchMode='array',cache=False,
+                              titles=['panel {0}'.format(i) for i in range(5)])
+
+    assert axes.shape == (2,3), axes.shape
+    # the panel without an image is hidden
+    assert not axes[1,2].get_visible()
+    panels = axes.ravel()[:5]
+    for ax in panels:
+        assert len(ax.images) == 1
+    assert len(set(ax.images[0].get_clim() for ax in panels)) == 1
+    assert server.requests == 5, server.requests
+
+
+def _collection(geoms):
+    """
+    FeatureCollection serving `geoms` from memory, `calls` counts its getInfo() requests
+    """
+
+    from shapely.geometry import mapping
+
+    fc = ee.featurecollection.FeatureCollection.__new__(ee.featurecollection.FeatureCollection)
+    fc.calls = {'size':0,'page':0}
+
+    class Info(object):
+        def __init__(self,kind,value):
+            self.kind,self.value = kind,value
+
+        def getInfo(self):
+            fc.calls[self.kind] += 1
+            return self.value()
+
+    def page(n,offset):
+        return [{'type':'Feature','geometry':mapping(geom),'properties':{}}
+                for geom in geoms[offset:offset+n]]
+
+    fc.serialize = lambda *args,**kwargs: json.dumps({'features':len(geoms)})
+    fc.select = lambda *args: fc
+    fc.size = lambda: Info('size',lambda: len(geoms))
+    fc.toList = lambda n,offset: Info('page',lambda: page(n,offset))
+
+    return fc
+
+
+def _featureGeometries():
+    """
+    30 rings with a hole each and one long line
+    """
+
+    from shapely.geometry import Polygon, LineString
+
+    t = np.linspace(0,2*np.pi,2000)
+    geoms = []
+    for i in range(30):
+        x,y = -150+i*10,(i % 5)*10-20
+        geoms.append(Polygon(np.c_[x+4*np.cos(t),y+4*np.sin(t)],
+                             [np.c_[x+np.cos(t),y+np.sin(t)][::-1]]))
+    geoms.append(LineString(np.c_[np.linspace(-170,170,5000),
+                                  10*np.sin(np.linspace(0,20,5000))]))
+
+    return geoms
+
+
+def _checkFeaturePaths(fc):
+    for proj in [ccrs.PlateCarree(),ccrs.Mollweide()]:
+        ax = _axes(proj)
+        ax.set_global()
+        cee.addFeatures(fc,ax,pageSize=7,workers=3,edgecolor='red')
+        paths = ax.collections[-1].get_paths()
+
+        assert len(paths) == 31, len(paths)
+        # the hole is a second ring of the same path
+        assert (paths[0].codes == Path.MOVETO).sum() == 2
+        assert sum(len(path.vertices) for path in paths) < 31*2000/4
+
+
+def testFeaturesAreFetchedOnceAndSimplified():
+    fc = _collection(_featureGeometries())
+    _resetCaches()
+
+    _checkFeaturePaths(fc)
+
+    # geometries are memoized across axes
+    assert fc.calls == {'size':1,'page':5}, fc.calls
+
+
+def testFeaturesWithShapely1():
+    from cartoee import features
+
+    class Shapely1(object):
+        """
+        shapely < 2 has none of the vectorized functions
+        """
+
+    fc = _collection(_featureGeometries())
+    _resetCaches()
+
+    shapely = features.shapely
+    features.shapely = Shapely1()
+    try:
+        _checkFeaturePaths(fc)
+    finally:
+        features.shapely = shapely
+
+
+def testOverlappingMapsReuseTiles():
+    from cartoee import maptiles
+
+    server = _fake()
+    img = server.image()
+    regions = [[-20,-40,60,40],[20,-40,100,40]]
+
+    def tileCount(region):
+        x0,x1,y0,y1 = maptiles._tileRange([region[0],region[2],region[1],region[3]],3)
+        return (x1-x0)*(y1-y0)
+
+    directory = tempfile.mkdtemp()
+    try:
+        thumbs = cache.ThumbCache(directory)
+        counts = []
+        for region in regions:
+            ax = cee.addLayer(img,_axes(),region=region,dims=[256,256],cmap='gist_earth',
+                              source='tiles',cache=thumbs)
+            counts.append(server.requests)
+            # only the thumbnail cache is left to reuse the tiles
+            maptiles._tileCache.clear()
+
+            assert ax.images[-1].get_array().shape == (256,256,4)
+    finally:
+        shutil.rmtree(directory)
+
+    # 256 pixels over 80 degrees is zoom level 3
+    assert counts[0] == tileCount(regions[0]), counts
+    # the maps share two of their three tile columns, only the new one is fetched
+    assert tileCount(regions[1]) == 6
+    assert counts[1]-counts[0] == 2, counts
+
+
+def testTilesAreKeptInMemoryByDefault():
+    server = _fake()
+    img = server.image()
+    regions = [[-20,-40,60,40],[20,-40,100,40]]
+
+    def counts(cache):
+        counts = []
+        for region in regions:
+            cee.addLayer(img,_axes(),region=region,dims=[256,256],cmap='gist_earth',
+                         source='tiles',cache=cache)
+            counts.append(server.requests)
+        return counts
+
+    assert cache.getCache() is None
+    first = counts(None)
+    assert first[1]-first[0] == 2, first
+
+    # cache=False also bypasses the tiles held in memory
+    server.requests = 0
+    second = counts(False)
+    assert second == [6,12], second
+
+
+def testWarpStageIsReported():
+    server = _fake()
+    img = server.image()
+
+    with cee.collectStats() as stats:
+        cee.addLayer(img,_axes(ccrs.Mollweide()),dims=[64,32],cache=False)
+    summary = stats.summary()
+
+    assert summary['warp']['count'] == 1, summary
+    assert summary['imshow']['count'] == 1, summary
+
+
+def testBenchmarkCompareFlagsSlowdowns():
+    baseline = [{'name':'slow','mean':0.1},{'name':'noise','mean':0.0001},
+                {'name':'same','mean':0.1}]
+    results = [{'name':'slow','mean':0.5},{'name':'noise','mean':0.001},
+               {'name':'same','mean':0.11},{'name':'new','mean':1.0}]
+
+    assert compare(results,baseline,tolerance=1.5) == ['slow']
+
+
+def testBenchmarkCompareScalesByCalibration():
+    baseline = [{'name':'calibration','mean':0.2,'p50':0.1},{'name':'case','mean':0.1}]
+    # a machine three times slower runs everything three times slower
+    results = [{'name':'calibration','mean':0.6,'p50':0.3},{'name':'case','mean':0.3}]
+
+    assert compare(results,baseline,tolerance=1.5) == []
+
+    results[1]['mean'] = 0.6
+    assert compare(results,baseline,tolerance=1.5) == ['case']
+
+
+def testColorbarUsesArrayLayer():
+    server = _fake()
+    img = server.image()
+
+    ax = cee.addLayer(img,_axes(),dims=[64,32],visParams={'min':-1,'max':1},
+                      cmap='magma',fetchMode='array',cache=False)
+    # a single band PNG layer drawn on top is already colorized
+    ax.imshow(np.zeros((4,4),dtype=np.uint8),extent=[-10,10,-10,10])
+    cb = cee.addColorbar(ax,loc='right')
+
+    assert cb.cmap.name == 'magma'
+    assert (cb.norm.vmin,cb.norm.vmax) == (-1,1)
+
+    ax = _axes()
+    ax.imshow(np.zeros((4,4),dtype=np.uint8),extent=[-10,10,-10,10])
+    try:
+        cee.addColorbar(ax,loc='right')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('colorbar drawn without a colormap')
+
+
+def testColorbarMatchesArrayLayerRange():
+    server = _fake()
+    img = server.image()
+
+    ax = cee.addLayer(img,_axes(),dims=[64,32],cmap='viridis',fetchMode='array',cache=False)
+    norm = ax.images[-1].norm
+    # the layer is scaled to the values of the fake image, -1 to 1
+    assert norm.vmin < -0.9 and norm.vmax > 0.9, (norm.vmin,norm.vmax)
+
+    cb = cee.addColorbar(ax,loc='right',cmap='viridis')
+    assert (cb.norm.vmin,cb.norm.vmax) == (norm.vmin,norm.vmax)
+
+    cb = cee.addColorbar(ax,loc='left',cmap='viridis',visParams={'max':2})
+    assert (cb.norm.vmin,cb.norm.vmax) == (norm.vmin,2)
+
+    colorbars = []
+    addColorbar = plotting.addColorbar
+    plotting.addColorbar = lambda *args,**kwargs: colorbars.append(addColorbar(*args,**kwargs))
+    try:
+        cee.renderMap(img,region=[-20,-40,60,40],dims=[64,32],cmap='viridis',fetchMode='array',
+                      colorbar='right',cache=False)
+    finally:
+        plotting.addColorbar = addColorbar
+
+    assert colorbars[0].norm.vmin < -0.9 and colorbars[0].norm.vmax > 0.9
+
+
+def testColorbarTemplateIsStampedOnEveryMap():
+    server = _fake()
+    img = server.image()
+    vis = {'min':-1,'max':1}
+
+    template = cee.ColorbarTemplate('right',cmap='gist_earth',visParams=vis)
+    height,width = template.image.shape[:2]
+    # a vertical colorbar with drawn pixels
+    assert height > width > 0, template.image.shape
+    assert template.image[:,:,3].any()
+
+    for _ in range(2):
+        ax = cee.getMap(img,region=[-20,-40,60,40],dims=[64,32],visParams=vis,
+                        cmap='gist_earth')
+        cax = template.stamp(ax)
+
+        assert cax.images[0].get_array().shape == template.image.shape
+        assert np.allclose(cax.get_position().bounds,template.position)
+        plt.savefig(io.BytesIO(),format='png')
+        plt.close()
+
+    assert server.requests == 1, server.requests
+
+
+def testProgressiveLayerIsRefinedWhenSaved():
+    server = _fake()
+    img = server.image()
+
+    ax = cee.addLayer(img,_axes(),dims=[512,256],progressive=64,cache=False)
+    assert ax.images[-1].get_array().shape[1] <= 64
+
+    # Agg never runs the refinement timer, drawing waits for the full image
+    plt.savefig(io.BytesIO(),format='png')
+
+    assert ax.images[-1].get_array().shape[:2] == (256,512)
+    assert server.requests == 2, server.requests
+
+
+def testRefineLayersWaitsForFullImage():
+    server = _fake()
+    img = server.image()
+
+    ax = cee.getMap(img,region=[-20,-40,60,40],dims=[512,256],cmap='gist_earth',
+                    progressive=64,cache=False)
+    assert ax.images[0].get_array().shape[1] <= 64
+
+    fig = cee.refineLayers(ax.figure)
+
+    assert fig is ax.figure
+    assert ax.images[0].get_array().shape[:2] == (256,512)
+    assert server.requests == 2, server.requests
+
+
+def testCliRendersIntoNewDirectories():
+    server = _fake()
+
+    directory = tempfile.mkdtemp()
+    spec = os.path.join(directory,'jobs.jsonl')
+    with open(spec,'w') as f:
+        for i in range(2):
+            f.write(json.dumps({'asset':'asset{0}'.format(i),'dims':[64,32],
+                                'output':'maps/{0}/map.png'.format(i)})+'\n')
+
+    # assets are resolved with ee.Image() in the worker, workers=1 renders in
+    # this process with the fake images
+    image = ee.Image
+    ee.Image = server.image
+    try:
+        cli.main(['render',spec,'--workers','1','--out-dir',directory,'--no-cache','--quiet',
+                  '--summary',os.path.join(directory,'summary.json')])
+    except SystemExit as e:
+        assert e.code == 0, e.code
+    finally:
+        ee.Image = image
+
+    try:
+        with open(os.path.join(directory,'summary.json')) as f:
+            summary = json.load(f)
+        assert (summary['jobs'],summary['failed']) == (2,0), summary
+        for i in range(2):
+            assert os.path.isfile(os.path.join(directory,'maps',str(i),'map.png'))
+        assert server.requests == 2, server.requests
+    finally:
+        shutil.rmtree(directory)
+
+
+def testCliUsage():
+    process = subprocess.Popen([sys.executable,'-m','cartoee'],stderr=subprocess.PIPE)
+    err = process.communicate()[1].decode('utf-8')
+    assert process.returncode == 2
+    assert 'usage: cartoee {render}' in err, err
+
+    process = subprocess.Popen([sys.executable,'-m','cartoee','render','--help'],
+                               stdout=subprocess.PIPE)
+    out = process.communicate()[0].decode('utf-8')
+    assert process.returncode == 0
+    assert '--out-dir' in out, out
+
+
+class _SlowStream(object):
+    """
+    Stream returning at most `n` bytes per read, like a network response
+    """
+
+    def __init__(self,data,n=1000):
+        self._buf = io.BytesIO(data)
+        self.n = n
+
+    def read(self,n=-1):
+        if n is None or n < 0:
+            n = self.n
+        return self._buf.read(min(n,self.n))
+
+
+def testDecodeNpyIntoMemmap():
+    a = np.zeros((1000,2000),dtype=[('b1','<f4'),('b2','<f4')])
+    a['b1'] = np.arange(2000)
+    a['b2'] = np.arange(1000)[:,None]
+    buf = io.BytesIO()
+    np.save(buf,a)
+    data = buf.getvalue()
+    del a,buf
+
+    directory = tempfile.mkdtemp()
+    try:
+        if tracemalloc:
+            tracemalloc.start()
+        out = plotting._decodeThumb(_SlowStream(data,100000),os.path.join(directory,'a.npy'))
+        if tracemalloc:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            # the decoded array is 16 MB, only strips are held in memory
+            assert peak < 2*1024**2, peak
+
+        assert isinstance(out,np.memmap)
+        assert out.shape == (1000,2000,2)
+        assert (out[5,:,0] == np.arange(2000)).all()
+        assert (out[:,7,1] == np.arange(1000)).all()
+        del out
+    finally:
+        shutil.rmtree(directory)
+
+
+def testDecodedPngIsWritable():
+    server = _fake()
+    a = plotting._decodeThumb(server.payload(64,32,'png'))
+
+    assert a.shape == (32,64,4)
+    a[0,0] = 0
+
+
+def testThumbSessionRetries():
+    import time
+    from cartoee.network import ThumbSession
+
+    server = _fake()
+    url = server.image().getThumbUrl({'dimensions':[64,32]})
+    session = ThumbSession(retries=2,backoff=0.1)
+
+    server.errors = [503,429]
+    t0 = time.time()
+    data = session.get(url)
+    assert data == server.payload(64,32,'png')
+    assert server.requests == 3, server.requests
+    # the second retry waits backoff * 2 seconds
+    assert time.time()-t0 >= 0.2
+
+    # the last error is raised once the retries are used up
+    server.errors = [503,503,503]
+    try:
+        session.get(url)
+    except requests.HTTPError as e:
+        assert e.response.status_code == 503
+    else:
+        raise AssertionError('expected a 503 error')
+    assert server.requests == 6, server.requests
+
+
+def testThumbSessionTimesOut():
+    from cartoee.network import ThumbSession
+
+    server = _fake()
+    url = server.image().getThumbUrl({'dimensions':[64,32]})
+    session = ThumbSession(readTimeout=0.1,retries=0)
+
+    server.latency = 0.5
+    try:
+        session.get(url)
+    except requests.ConnectionError as e:
+        # requests reports a read timeout after the retries as a ConnectionError
+        assert 'timed out' in str(e), e
+    else:
+        raise AssertionError('expected a timeout')
+    finally:
+        server.latency = 0.0
+
+
+def testThumbSessionReleasesSlotsOnErrors():
+    from cartoee.network import ThumbSession
+
+    server = _fake()
+    url = server.image().getThumbUrl({'dimensions':[64,32]})
+    session = ThumbSession(retries=0,maxConcurrent=1,readTimeout=0.1)
+
+    server.errors = [503,500]
+    for _ in range(2):
+        try:
+            session.get(url)
+        except requests.HTTPError:
+            pass
+
+    server.latency = 0.5
+    try:
+        session.get(url)
+    except requests.ConnectionError:
+        pass
+    finally:
+        server.latency = 0.0
+
+    # with a leaked slot this would block
+    assert session._slots.acquire(False)
+    session._slots.release()
+    assert session.get(url) == server.payload(64,32,'png')
+
+
+def testBuildPaletteUnknownName():
+    try:
+        cee.buildPalette('notacolormap')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('expected a ValueError')
+
+
+def testPaletteCacheIsBounded():
+    from cartoee import palette
+
+    _fake()
+    for n in range(2,palette._paletteCacheSize+12):
+        cee.buildPalette('viridis',n)
+
+    assert len(palette._paletteCache) == palette._paletteCacheSize
+    assert ('viridis',2) not in palette._paletteCache
+
+
+def testColorbarMappingsAreNotShared():
+    _fake()
+    palette = cee.buildPalette('viridis',8)
+
+    for discrete in [False,True]:
+        cmap,norm = plotting._colorbarMapping(palette,0,1,discrete)
+        cmap.set_under('red')
+        norm.vmin = -5
+
+        other,otherNorm = plotting._colorbarMapping(palette,0,1,discrete)
+        assert other is not cmap
+        assert tuple(other.get_under()[:3]) != (1.0,0.0,0.0), other.get_under()
+        assert otherNorm.vmin == 0, otherNorm.vmin
+
+    assert len(plotting._colorbarCache) == 2
+
+
+def testCliColorbarLocation():
+    # under python 2 the json module returns unicode strings
+    spec = json.loads('{"asset":"srtm","colorbar":"bottom"}')
+    job = cli._batchJob(0,spec,None)
+
+    assert job['colorbar'] == {'loc':'bottom','orientation':'horizontal'}, job['colorbar']
+
+
+def _runAsync(coroutine):
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def testAsyncFallbackWithoutAiohttp():
+    if sys.version_info < (3,5):
+        return
+    from cartoee import aio
+
+    server = _fake()
+    img = server.image()
+
+    aiohttp = aio.aiohttp
+    aio.aiohttp = None
+    try:
+        ax = _runAsync(cee.getMapAsync(img,dims=[64,32],cache=False))
+        assert ax.images[-1].get_array().shape == (32,64,4)
+        assert server.requests == 1, server.requests
+
+        ax = _runAsync(cee.addLayerAsync(img,_axes(),dims=[64,32],tiles=2,cache=False))
+        assert ax.images[-1].get_array().shape == (32,64,4)
+        assert server.requests == 5, server.requests
+    finally:
+        aio.aiohttp = aiohttp
+
+
+def testAsyncClientRetries():
+    if sys.version_info < (3,5):
+        return
+    from cartoee import aio
+    if aio.aiohttp is None:
+        return
+
+    server = _fake()
+    img = server.image()
+
+    session = cee.getSession()
+    cee.configureSession(backoff=0,retries=2)
+    try:
+        server.errors = [503,429]
+        ax = _runAsync(cee.addLayerAsync(img,_axes(),dims=[64,32],cache=False))
+        assert ax.images[-1].get_array().shape == (32,64,4)
+        assert server.requests == 3, server.requests
+
+        # the last error is raised once the retries are used up
+        server.errors = [503,503,503]
+        try:
+            _runAsync(cee.addLayerAsync(img,_axes(),dims=[64,32],cache=False))
+        except aio.aiohttp.ClientResponseError as e:
+            assert e.status == 503
+        else:
+            raise AssertionError('expected a 503 error')
+        assert server.requests == 6, server.requests
+    finally:
+        cee.setSession(session)
+
+
+def main():
+    tests = sorted((name,func) for name,func in globals().items()
+                   if name.startswith('test') and callable(func))
+
+    failed = []
+    for name,func in tests:
+        try:
+            func()
+            print('{0:<45} ok'.format(name))
+        except Exception:
+            traceback.print_exc()
+            print('{0:<45} FAILED'.format(name))
+            failed.append(name)
+        finally:
+            plt.close('all')
+
+    if _server is not None:
+        _server.close()
+
+    print('{0} tests, {1} failed'.format(len(tests),len(failed)))
+
+    if failed:
+        sys.exit(1)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+from __future__ import print_function, division
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import cartopy.crs as ccrs
+
+_indexCache = OrderedDict()
+_indexLock = threading.Lock()
+_indexCacheSize = 16
+
+
+def _projKey(proj):
+    return proj.proj4_init
+
+
+def isPlateCarree(proj):
+    """
+    Check if a projection is the default PlateCarree images are requested in
+    """
+
+    return _projKey(proj) == _projKey(ccrs.PlateCarree())
+
+
+def serverCrs(proj):
+    """
+    Get the Earth Engine crs string for a cartopy projection, None if it has no EPSG code
+    """
+
+    toEpsg = getattr(proj,'to_epsg',None)
+    if toEpsg is None:
+        return None
+
+    try:
+        code = toEpsg()
+    except Exception:
+        return None
+
+    if code is None:
+        return None
+
+    return 'EPSG:{0}'.format(code)
+
+
+def projectedExtent(viewExtent,proj,n=101):
+    """
+    Get the [xmin,xmax,ymin,ymax] bounds of a lon/lat extent in a projection
+
+    The extent is sampled on an n x n grid so curved edges and extents that
+    wrap around the visible part of the projection are covered, points that
+    cannot be projected are ignored
+    """
+
+    w,e,s,n_ = viewExtent
+    lons,lats = np.meshgrid(np.linspace(w,e,n),np.linspace(s,n_,n))
+
+    xy = proj.transform_points(ccrs.PlateCarree(),lons.ravel(),lats.ravel())
+    x,y = xy[:,0],xy[:,1]
+    valid = np.isfinite(x) & np.isfinite(y)
+    x,y = x[valid],y[valid]
+
+    xmin = max(x.min(),proj.x_limits[0])
+    xmax = min(x.max(),proj.x_limits[1])
+    ymin = max(y.min(),proj.y_limits[0])
+    ymax = min(y.max(),proj.y_limits[1])
+
+    return [xmin,xmax,ymin,ymax]
+
+
+def warpIndices(viewExtent,shape,proj):
+    """
+    Get the nearest neighbour source indices to warp a lon/lat image into a projection
+
+    Indices are cached per (source extent, shape, target projection) so
+    repeated renders into the same projection only compute them once.
+
+    Args:
+        viewExtent (list | tuple): [W,E,S,N] extent of the source image
+        shape (tuple): (HEIGHT,WIDTH) of the source image
+        proj (cartopy.crs.Projection): projection to warp into
+
+    Returns:
+        rows (numpy.ndarray): source row of each target pixel
+        cols (numpy.ndarray): source column of each target pixel
+        mask (numpy.ndarray): True for target pixels outside of the source image
+        extent (list): [xmin,xmax,ymin,ymax] extent of the target image in the projection
+    """
+
+    key = (tuple(float(v) for v in viewExtent),tuple(shape[:2]),_projKey(proj))
+
+    with _indexLock:
+        if key in _indexCache:
+            value = _indexCache.pop(key)
+            _indexCache[key] = value
+            return value
+
+    height,width = shape[:2]
+    w,e,s,n = viewExtent
+    extent = projectedExtent(viewExtent,proj)
+
+    # keep about the same number of pixels as the source image
+    aspect = (extent[1]-extent[0]) / (extent[3]-extent[2])
+    tw = max(int(round(np.sqrt(height*width*aspect))),1)
+    th = max(int(round(np.sqrt(height*width/aspect))),1)
+
+    dx = (extent[1]-extent[0]) / tw
+    dy = (extent[3]-extent[2]) / th
+    xs = extent[0] + dx*(np.arange(tw)+0.5)
+    ys = extent[3] - dy*(np.arange(th)+0.5)
+    x,y = np.meshgrid(xs,ys)
+
+    lonlat = ccrs.PlateCarree().transform_points(proj,x.ravel(),y.ravel())
+    lon = lonlat[:,0].reshape(th,tw)
+    lat = lonlat[:,1].reshape(th,tw)
+
+    with np.errstate(invalid='ignore'):
+        cols = np.floor((lon-w) / (e-w) * width)
+        rows = np.floor((n-lat) / (n-s) * height)
+        mask = ~(np.isfinite(cols) & np.isfinite(rows) &
+                 (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height))
+
+    cols = np.where(mask,0,cols).astype(np.int32)
+    rows = np.where(mask,0,rows).astype(np.int32)
+
+    value = (rows,cols,mask,extent)
+
+    with _indexLock:
+        _indexCache[key] = value
+        while len(_indexCache) > _indexCacheSize:
+            _indexCache.popitem(last=False)
+
+    return value
+
+
+def warpArray(a,viewExtent,proj):
+    """
+    Warp a lon/lat image array into a projection using cached indices
+
+    Pixels outside of the source image are masked for single band arrays and
+    made transparent for RGB(A) arrays.
+
+    Args:
+        a (numpy.ndarray): (HEIGHT,WIDTH) or (HEIGHT,WIDTH,BANDS) image in lon/lat
+        viewExtent (list | tuple): [W,E,S,N] extent of the image
+        proj (cartopy.crs.Projection): projection to warp into
+
+    Returns:
+        out (numpy.ndarray): warped image
+        extent (list): [xmin,xmax,ymin,ymax] extent of the warped image in the projection
+    """
+
+    rows,cols,mask,extent = warpIndices(viewExtent,a.shape,proj)
+
+    out = a[rows,cols]
+
+    if out.ndim == 2:
+        return np.ma.masked_array(out,mask=mask | np.ma.getmaskarray(out)),extent
+
+    out = np.ma.getdata(out)
+    opaque = 255 if out.dtype == np.uint8 else 1
+    if out.shape[2] == 4:
+        out[mask,3] = 0
+    else:
+        alpha = np.where(mask,0,opaque).astype(out.dtype)
+        out = np.dstack([out,alpha])
+
+    return out,extent
@@ -1,5 +1,20 @@
+import sys
 import setuptools
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+class BuildPy(build_py):
+    """
+    Leave out cartoee.aio under python 2, async def is a syntax error there
+    """
+
+    def find_package_modules(self,package,package_dir):
+        modules = build_py.find_package_modules(self,package,package_dir)
+        if sys.version_info < (3,5):
+            modules = [m for m in modules if m[:2] != ('cartoee','aio')]
+        return modules
+
 
 with open("README.md", "r") as fh:
     long_description = fh.read()
@@ -16,20 +31,33 @@ setup(name='cartoee',
       license='GNU GPL v3',
       zip_safe=False,
       include_package_data=True,
+      cmdclass={'build_py': BuildPy},
       install_requires=[
           'matplotlib',
+          'pillow',
           'Cython',
           'geos',
           'pyproj',
+          'shapely',
           'cartopy==0.16.0',
           'oauth2client',
           'google-api-python-client',
           'earthengine-api',
+          'requests',
+          'futures; python_version < "3"',
       ],
+      extras_require={
+          'async': ['aiohttp; python_version >= "3.5"'],
+          'yaml': ['pyyaml'],
+      },
       entry_points={
         'console_scripts': [
+            'cartoee = cartoee.cli:main',
             'cee_install_test = cartoee.tests.installation_test:main',
-            'cee_plotting_test = cartoee.tests.plotting_test:main'
+            'cee_plotting_test = cartoee.tests.plotting_test:main',
+            'cee_benchmark = cartoee.tests.benchmark:main',
+            'cee_import_test = cartoee.tests.import_test:main',
+            'cee_offline_test = cartoee.tests.offline_test:main'
         ],
       },
 )